@@ -0,0 +1,146 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from app.config import Config
+from app.ratelimit import RateLimiter
+from app.replay import ReplaySessionPool
+
+
+def percentile(values, pct):
+    """Percentil com interpolação linear (pct entre 0 e 100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * pct / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(name, latencies, elapsed, peak_bytes):
+    return {
+        "name": name,
+        "calls": len(latencies),
+        "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "peak_mb": peak_bytes / (1024 * 1024),
+    }
+
+
+def bench_scrapers(fixtures_dir, terms, cep, runs):
+    """Mede search_medication de cada scraper sobre as fixtures."""
+    from main import build_scrapers
+
+    reports = []
+    for index in range(len(build_scrapers())):
+        latencies = []
+        tracemalloc.start()
+        started = time.perf_counter()
+        for _ in range(runs):
+            # Scrapers novos a cada rodada, para não medir o cache de PDP da rodada anterior
+            scraper = build_scrapers(
+                rate_limiter=RateLimiter.unlimited(),
+                session_pool=ReplaySessionPool(fixtures_dir)
+            )[index]
+            for term in terms:
+                call_started = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    list(scraper.search_medication(term, cep=cep))
+                latencies.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        reports.append(summarize(f"{scraper.pharmacy}.search_medication", latencies, elapsed, peak))
+    return reports
+
+
+def bench_full_run(fixtures_dir, runs):
+    """Mede main() completo (modo serial e concorrente) sobre as fixtures, com banco temporário."""
+    import main
+
+    reports = []
+    for concurrent in (False, True):
+        latencies = []
+        tracemalloc.start()
+        started = time.perf_counter()
+        for _ in range(runs):
+            tmp_dir = tempfile.mkdtemp(prefix="pharma-bench-")
+            try:
+                run_started = time.perf_counter()
+                # As métricas da execução vão para o diretório temporário, não para o METRICS_DIR real
+                with contextlib.redirect_stdout(io.StringIO()), _env(METRICS_DIR=os.path.join(tmp_dir, "metrics")):
+                    main.main(
+                        concurrent=concurrent,
+                        replay_dir=fixtures_dir,
+                        dry_run=True,
+                        db_name=os.path.join(tmp_dir, "bench.db")
+                    )
+                latencies.append(time.perf_counter() - run_started)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        reports.append(summarize(f"main ({'concorrente' if concurrent else 'serial'})", latencies, elapsed, peak))
+    return reports
+
+
+@contextlib.contextmanager
+def _env(**values):
+    """Sobrescreve variáveis de ambiente (lidas pelo Config) durante o bloco."""
+    previous = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def print_reports(reports):
+    print(f"{'etapa':<42} {'chamadas':>8} {'por s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'pico MB':>8}")
+    for r in reports:
+        print(f"{r['name']:<42} {r['calls']:>8} {r['throughput_per_s']:>8.1f} "
+              f"{r['p50_ms']:>9.1f} {r['p90_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['peak_mb']:>8.1f}")
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"RSS máximo do processo: {max_rss_mb:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline dos scrapers")
+    parser.add_argument("--fixtures", required=True, help="Diretório gravado com main.py --record")
+    parser.add_argument("--runs", type=int, default=3, help="Rodadas por medição")
+    parser.add_argument("--terms", nargs="*", default=None,
+                        help="Termos de busca (padrão: os search_term do config.json)")
+    parser.add_argument("--skip-full", action="store_true", help="Não mede a execução completa de main()")
+    parser.add_argument("--json", default=None, help="Salva o resultado em JSON para comparar entre commits")
+    args = parser.parse_args()
+
+    config_data = Config.load_products()
+    terms = args.terms or list(dict.fromkeys(p["search_term"] for p in config_data.get("products", [])))
+    cep = config_data.get("cep")
+
+    reports = bench_scrapers(args.fixtures, terms, cep, args.runs)
+    if not args.skip_full:
+        reports += bench_full_run(args.fixtures, args.runs)
+    print_reports(reports)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"runs": args.runs, "terms": terms, "results": reports}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
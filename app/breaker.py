@@ -0,0 +1,162 @@
+import threading
+from datetime import datetime
+from urllib.parse import urlparse
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Requisição recusada sem ir à rede: o circuito do host está aberto."""
+
+
+class HostCircuit:
+    def __init__(self, cooldown, state=CLOSED, failures=0, opened_at=None, last_error=None):
+        self.state = state
+        self.failures = failures
+        self.opened_at = opened_at
+        self.cooldown = cooldown
+        self.last_error = last_error
+        self.skipped = 0
+        self.probing = False
+
+    def reopens_at(self):
+        return self.opened_at.timestamp() + self.cooldown if self.opened_at else 0.0
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por host, compartilhado por todos os scrapers e guardado na tabela
+    circuit_breaker do prices.db entre execuções.
+
+    - closed: tudo passa; `failure_threshold` falhas seguidas (403/429/5xx, timeout ou erro
+      de conexão) abrem o circuito.
+    - open: nenhuma requisição sai (nem o fallback httpx) até passar o `cooldown`.
+    - half_open: uma única requisição de teste; sucesso fecha o circuito, falha reabre
+      com o dobro do cooldown (até `max_cooldown`).
+    """
+
+    FAILURE_STATUSES = (403, 429)
+
+    def __init__(self, db=None, failure_threshold=3, cooldown=900, max_cooldown=6 * 3600, enabled=True):
+        self.db = db
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.enabled = enabled
+        self.circuits = {}
+        self._lock = threading.Lock()
+        if db is not None and enabled:
+            self.load()
+
+    @classmethod
+    def disabled(cls):
+        """Breaker que deixa tudo passar, para execuções sem rede (replay/benchmark)."""
+        return cls(enabled=False)
+
+    def load(self):
+        for host, state, failures, opened_at, cooldown, last_error in self.db.get_circuit_states():
+            self.circuits[host] = HostCircuit(
+                cooldown or self.base_cooldown, state, failures or 0, _parse_datetime(opened_at), last_error
+            )
+
+    def _circuit(self, host):
+        if host not in self.circuits:
+            self.circuits[host] = HostCircuit(self.base_cooldown)
+        return self.circuits[host]
+
+    def _save(self, host, circuit):
+        if self.db is not None:
+            self.db.save_circuit_state(
+                host, circuit.state, circuit.failures, circuit.opened_at, circuit.cooldown, circuit.last_error
+            )
+
+    def is_open(self, host):
+        """True se o host está bloqueado agora (aberto e ainda dentro do cooldown)."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            circuit = self.circuits.get(host)
+            return bool(circuit and circuit.state == OPEN and datetime.now().timestamp() < circuit.reopens_at())
+
+    def skip(self, host):
+        """Registra uma busca inteira pulada por causa do circuito aberto."""
+        with self._lock:
+            self._circuit(host).skipped += 1
+
+    def allow(self, url):
+        if not self.enabled:
+            return True
+        host = urlparse(url).hostname or url
+        with self._lock:
+            circuit = self._circuit(host)
+            if circuit.state == OPEN:
+                if datetime.now().timestamp() < circuit.reopens_at():
+                    circuit.skipped += 1
+                    return False
+                circuit.state = HALF_OPEN
+                circuit.probing = False
+            if circuit.state == HALF_OPEN:
+                if circuit.probing:
+                    circuit.skipped += 1
+                    return False
+                circuit.probing = True
+            return True
+
+    def check(self, url):
+        if not self.allow(url):
+            raise CircuitOpenError(f"circuito aberto para {urlparse(url).hostname}")
+
+    def record(self, url, status=None, error=None):
+        """Resultado de uma requisição: `status` HTTP ou `error` (exceção de rede)."""
+        if not self.enabled:
+            return
+        host = urlparse(url).hostname or url
+        failed = error is not None or status in self.FAILURE_STATUSES or (status is not None and status >= 500)
+        with self._lock:
+            circuit = self._circuit(host)
+            circuit.probing = False
+            if not failed:
+                if circuit.state == CLOSED and not circuit.failures:
+                    return
+                if circuit.state != CLOSED:
+                    print(f"    Circuito de {host} fechado: o site voltou a responder")
+                circuit.state, circuit.failures, circuit.opened_at = CLOSED, 0, None
+                circuit.cooldown = self.base_cooldown
+            else:
+                circuit.failures += 1
+                circuit.last_error = str(error) if error is not None else f"status {status}"
+                if circuit.state == HALF_OPEN:
+                    circuit.cooldown = min(self.max_cooldown, circuit.cooldown * 2)
+                    self._open(host, circuit)
+                elif circuit.state == CLOSED and circuit.failures >= self.failure_threshold:
+                    self._open(host, circuit)
+            self._save(host, circuit)
+
+    def _open(self, host, circuit):
+        circuit.state = OPEN
+        circuit.opened_at = datetime.now()
+        print(f"    Circuito de {host} aberto após {circuit.failures} falhas ({circuit.last_error}); "
+              f"nova tentativa em {circuit.cooldown / 60:.0f} min")
+
+    def report(self):
+        circuits = {host: c for host, c in self.circuits.items() if c.state != CLOSED or c.skipped}
+        if not circuits:
+            return
+        print("\nCircuit breaker por host:")
+        for host, circuit in sorted(circuits.items()):
+            line = f"  {host}: {circuit.state}, {circuit.skipped} requisições/buscas evitadas"
+            if circuit.state != CLOSED:
+                reopen = datetime.fromtimestamp(circuit.reopens_at())
+                line += f", nova tentativa às {reopen:%H:%M} (último erro: {circuit.last_error})"
+            print(line)
+
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
@@ -0,0 +1,79 @@
+import threading
+import time
+
+
+class TTLCache:
+    """Cache em memória, seguro entre threads, cujas entradas expiram após `ttl_seconds`."""
+
+    def __init__(self, ttl_seconds=900, max_entries=2048):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.max_entries and key not in self._data:
+                # Descarta a entrada inserida há mais tempo
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+
+
+class ShippingCache:
+    """
+    Cache persistente (tabela shipping_cache do prices.db) para cotações de frete.
+    A chave é (farmácia, sku, CEP); o TTL pode ser ajustado por farmácia.
+    """
+
+    def __init__(self, db, ttl_hours=24, max_entries=10000, ttl_by_pharmacy=None):
+        self.db = db
+        self.ttl_hours = ttl_hours
+        self.max_entries = max_entries
+        self.ttl_by_pharmacy = ttl_by_pharmacy or {}
+        self.hits = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+
+    def ttl_for(self, pharmacy):
+        return self.ttl_by_pharmacy.get(pharmacy, self.ttl_hours)
+
+    def get_many(self, pharmacy, skus, cep):
+        """Retorna ({sku: frete} em cache, [skus que precisam ir para a rede])."""
+        skus = list(dict.fromkeys(str(sku) for sku in skus))
+        cached = self.db.get_cached_shipping(pharmacy, skus, cep, self.ttl_for(pharmacy))
+        missing = [sku for sku in skus if sku not in cached]
+        with self._lock:
+            self.hits[pharmacy] = self.hits.get(pharmacy, 0) + len(cached)
+            self.misses[pharmacy] = self.misses.get(pharmacy, 0) + len(missing)
+        return cached, missing
+
+    def put_many(self, pharmacy, cep, quotes):
+        self.db.save_shipping_quotes(pharmacy, cep, quotes)
+
+    def evict(self):
+        # O maior TTL configurado define a idade máxima mantida no banco
+        max_age = max([self.ttl_hours, *self.ttl_by_pharmacy.values()])
+        return self.db.evict_shipping_cache(max_age, self.max_entries)
+
+    def invalidate(self, pharmacy=None):
+        return self.db.invalidate_shipping_cache(pharmacy)
+
+    def report(self):
+        print("\nCache de frete (hits/misses):")
+        for pharmacy in sorted(set(self.hits) | set(self.misses)):
+            hits = self.hits.get(pharmacy, 0)
+            misses = self.misses.get(pharmacy, 0)
+            total = hits + misses
+            rate = (hits / total * 100) if total else 0.0
+            print(f"  {pharmacy}: {hits}/{misses} ({rate:.0f}% de acerto)")
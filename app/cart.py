@@ -0,0 +1,105 @@
+from collections import namedtuple
+
+# Uma quantidade de caixas cotada: preço das caixas (com promoção), frete, total, custo por caixa
+# e o texto da promoção atingida ("" se nenhuma faixa se aplica a essa quantidade)
+CartOption = namedtuple("CartOption", ["boxes", "items_total", "shipping", "total", "per_box", "promotion"])
+
+
+def promotion_tiers(teasers):
+    """
+    Faixas de promoção progressiva dos teasers VTEX como (quantidade mínima, % de desconto
+    no último item), ex: "Leve 3 Pague 2" = (3, 100.0). Teasers sem desconto são ignorados.
+    """
+    tiers = []
+    for teaser in teasers or []:
+        try:
+            min_qty = int(teaser.get("conditions", {}).get("minimumQuantity", 1))
+            discount_pct = 0.0
+            for param in teaser.get("effects", {}).get("parameters", []):
+                if param.get("name") == "PercentualDiscount":
+                    discount_pct = float(param.get("value", 0))
+        except (TypeError, ValueError, AttributeError):
+            continue
+        if min_qty > 1 and discount_pct > 0:
+            tiers.append((min_qty, discount_pct))
+    return tuple(tiers)
+
+
+def _best_tier(tiers, boxes):
+    """Melhor faixa para `boxes` caixas: (caixas efetivamente pagas, faixa ou None)."""
+    best = (boxes, None)
+    for min_qty, discount_pct in tiers:
+        groups, rest = divmod(boxes, min_qty)
+        if groups:
+            paid = groups * (min_qty - discount_pct / 100.0) + rest
+            if paid < best[0]:
+                best = (paid, (min_qty, discount_pct))
+    return best
+
+
+def promotion_total(base_price, tiers, boxes):
+    """Preço de `boxes` caixas usando a melhor faixa: cada grupo completo ganha o desconto no último item."""
+    return base_price * _best_tier(tiers, boxes)[0]
+
+
+def promotion_label(tiers, boxes):
+    """Texto da faixa aplicada a `boxes` caixas, ex: "Leve 3 Pague 2"; "" se a quantidade não atinge nenhuma."""
+    tier = _best_tier(tiers, boxes)[1]
+    if tier is None:
+        return ""
+    min_qty, discount_pct = tier
+    if discount_pct < 100:
+        return f"Leve {min_qty} com {discount_pct}% no último"
+    return f"Leve {min_qty} Pague {min_qty - 1}"
+
+
+def cart_quantities(max_boxes, available_qty):
+    """Quantidades de caixas a cotar: de 1 até `max_boxes`, limitado ao estoque."""
+    return range(1, max(1, min(max_boxes, available_qty)) + 1)
+
+
+def cart_key(sku, boxes):
+    """Chave da cotação de frete de `boxes` caixas de um SKU (a de 1 caixa é o próprio SKU)."""
+    return str(sku) if boxes == 1 else f"{sku}x{boxes}"
+
+
+def split_cart_key(key):
+    sku, _, boxes = str(key).partition("x")
+    return sku, int(boxes or 1)
+
+
+def quoted_shipping(costs, sku, boxes, single_box_shipping):
+    """
+    {caixas: frete} das quantidades cotadas de um SKU a partir de {cart_key: frete}. A de
+    1 caixa sempre entra (com o frete já usado na oferta); as maiores só se a cotação veio,
+    para que uma falha não pareça frete grátis.
+    """
+    shipping = {1: single_box_shipping}
+    if sku:
+        for n in boxes:
+            if n > 1 and cart_key(sku, n) in costs:
+                shipping[n] = costs[cart_key(sku, n)]
+    return shipping
+
+
+def cart_options(base_price, tiers, shipping_by_boxes):
+    """
+    Opções de compra a partir dos fretes cotados {caixas: frete}. Só ficam as quantidades
+    que baixam o custo por caixa em relação a todas as menores: comprar mais caixas só
+    compensa se atingir uma faixa de promoção ou um frete menor.
+    """
+    options = []
+    for boxes in sorted(shipping_by_boxes):
+        items_total = promotion_total(base_price, tiers, boxes)
+        total = items_total + shipping_by_boxes[boxes]
+        option = CartOption(boxes, items_total, shipping_by_boxes[boxes], total, total / boxes,
+                            promotion_label(tiers, boxes))
+        if not options or option.per_box < options[-1].per_box - 0.005:
+            options.append(option)
+    return options
+
+
+def best_option(options, max_boxes=None):
+    """Menor custo por caixa entre as opções com até `max_boxes` caixas (as opções já vêm em ordem)."""
+    allowed = [option for option in options if max_boxes is None or option.boxes <= max_boxes]
+    return allowed[-1] if allowed else None
@@ -0,0 +1,204 @@
+import json
+import os
+import sys
+from array import array
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+# (coluna, typecode do array, expressão SQL). Texto repetido vira código de dicionário;
+# timestamp vira segundos desde 1970 (horário local, como gravado no banco)
+COLUMNS = (
+    ("id", "q", "id"),
+    ("timestamp", "d", "(julianday(timestamp) - 2440587.5) * 86400.0"),
+    ("pharmacy", "H", "pharmacy"),
+    ("product", "I", "COALESCE(monitored_product, product_name)"),
+    ("title", "I", "product_name"),
+    ("unit_price", "d", "unit_price"),
+    ("total_price", "d", "total_price"),
+    ("shipping_cost", "d", "shipping_cost"),
+    ("total_effective_price", "d", "total_effective_price"),
+    ("is_kit", "b", "is_kit"),
+    ("kit_size", "i", "kit_size"),
+    ("is_best_offer", "b", "is_best_offer"),
+    ("notified", "b", "notified"),
+)
+DICTIONARY_COLUMNS = ("pharmacy", "product", "title")
+NUMPY_KINDS = {"q": "i", "i": "i", "b": "i", "H": "u", "I": "u", "d": "f"}
+MISSING = {"d": float("nan"), "q": 0, "i": 0, "b": 0}
+
+
+class ColumnarExport:
+    """
+    Exporta o price_history para um diretório com um arquivo binário por coluna
+    (`<coluna>.bin`, valores crus do módulo array) e um manifest.json com os tipos, os
+    dicionários de farmácia/produto/título e o último id exportado.
+
+    A exportação é incremental: cada execução só lê as linhas com id maior que o último
+    exportado, em blocos, e as acrescenta ao fim dos arquivos. Se linhas já exportadas
+    sumiram do banco (ex: `db compact`), a exportação é refeita do zero. O last_seen,
+    que muda depois da gravação, não faz parte da exportação.
+    """
+
+    def __init__(self, db, directory, chunk_size=50000):
+        self.db = db
+        self.directory = directory
+        self.chunk_size = chunk_size
+
+    def run(self, full=False):
+        """Exporta as linhas novas (ou todas, com `full`). Retorna (linhas novas, total exportado)."""
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = None if full else read_manifest(self.directory)
+        if manifest and not self._still_valid(manifest):
+            print("  Linhas já exportadas foram removidas do banco; refazendo a exportação completa.")
+            manifest = None
+        if manifest is None:
+            manifest = self._empty_manifest()
+            for name, _, _ in COLUMNS:
+                open(self._path(name), "wb").close()
+        else:
+            self._truncate_to(manifest)
+
+        codes = {name: {value: code for code, value in enumerate(manifest["dictionaries"][name])}
+                 for name in DICTIONARY_COLUMNS}
+        files = {name: open(self._path(name), "ab") for name, _, _ in COLUMNS}
+        added = 0
+        try:
+            with self.db.lock:
+                cursor = self.db.conn.cursor()
+                cursor.execute(f"""
+                    SELECT {", ".join(sql for _, _, sql in COLUMNS)} FROM price_history
+                    WHERE id > ? ORDER BY id
+                """, (manifest["last_id"],))
+                while True:
+                    rows = cursor.fetchmany(self.chunk_size)
+                    if not rows:
+                        break
+                    self._write_chunk(rows, files, codes)
+                    added += len(rows)
+                    manifest["last_id"] = rows[-1][0]
+        finally:
+            for f in files.values():
+                f.close()
+
+        manifest["rows"] += added
+        for name in DICTIONARY_COLUMNS:
+            manifest["dictionaries"][name] = list(codes[name])
+        # O manifest é gravado por último: se a exportação for interrompida, os bytes
+        # extras nos .bin são descartados na próxima execução
+        write_manifest(self.directory, manifest)
+        return added, manifest["rows"]
+
+    def _write_chunk(self, rows, files, codes):
+        # Transpõe o bloco de linhas em colunas de uma vez
+        for (name, typecode, _), values in zip(COLUMNS, zip(*rows)):
+            if name in codes:
+                mapping = codes[name]
+                values = [mapping.setdefault(value, len(mapping)) for value in values]
+            elif None in values:
+                values = [MISSING[typecode] if value is None else value for value in values]
+            array(typecode, values).tofile(files[name])
+
+    def _still_valid(self, manifest):
+        if manifest.get("version") != FORMAT_VERSION or manifest.get("byteorder") != sys.byteorder:
+            return False
+        with self.db.lock:
+            count = self.db.conn.execute(
+                "SELECT COUNT(*) FROM price_history WHERE id <= ?", (manifest["last_id"],)
+            ).fetchone()[0]
+        return count == manifest["rows"]
+
+    def _truncate_to(self, manifest):
+        for name, typecode, _ in COLUMNS:
+            with open(self._path(name), "ab") as f:
+                f.truncate(manifest["rows"] * array(typecode).itemsize)
+
+    def _empty_manifest(self):
+        return {
+            "version": FORMAT_VERSION,
+            "byteorder": sys.byteorder,
+            "rows": 0,
+            "last_id": 0,
+            "columns": {name: {"typecode": typecode, "dtype": _numpy_dtype(typecode)}
+                        for name, typecode, _ in COLUMNS},
+            "dictionaries": {name: [] for name in DICTIONARY_COLUMNS},
+        }
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.bin")
+
+
+class ColumnarHistory:
+    """Histórico exportado: `columns` {nome: array} e `dictionaries` {nome: [valores]}."""
+
+    def __init__(self, rows, columns, dictionaries):
+        self.rows = rows
+        self.columns = columns
+        self.dictionaries = dictionaries
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return self.rows
+
+    def decode(self, name):
+        """Valores de texto de uma coluna codificada (farmácia, produto ou título)."""
+        dictionary = self.dictionaries[name]
+        try:
+            import numpy as np
+        except ImportError:
+            return [dictionary[code] for code in self.columns[name]]
+        return np.asarray(dictionary, dtype=object)[self.columns[name]]
+
+
+def load_columnar(directory):
+    """
+    Carrega uma exportação. Com numpy instalado, cada coluna é um np.memmap somente leitura
+    (nada é lido do disco até ser usado); sem numpy, os arquivos são lidos em objetos array.
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"Nenhuma exportação encontrada em {directory}")
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    rows = manifest["rows"]
+    columns = {}
+    for name, spec in manifest["columns"].items():
+        path = os.path.join(directory, f"{name}.bin")
+        if np is not None:
+            dtype = np.dtype(spec["dtype"])
+            # np.memmap não aceita arquivos vazios
+            columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=(rows,)) if rows else np.empty(0, dtype)
+        else:
+            values = array(spec["typecode"])
+            with open(path, "rb") as f:
+                values.fromfile(f, rows)
+            if manifest["byteorder"] != sys.byteorder:
+                values.byteswap()
+            columns[name] = values
+    return ColumnarHistory(rows, columns, manifest["dictionaries"])
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _numpy_dtype(typecode):
+    order = "<" if sys.byteorder == "little" else ">"
+    return f"{order}{NUMPY_KINDS[typecode]}{array(typecode).itemsize}"
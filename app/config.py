@@ -1,20 +1,116 @@
 import os
 import json
-from dotenv import load_dotenv
 
 env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "monitor.env")
-load_dotenv(env_path)
+_env_loaded = False
+
+
+def load_env():
+    """Lê o monitor.env uma única vez, no primeiro acesso a uma configuração (e não no import)."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv(env_path)
+        _env_loaded = True
+
+
+def as_bool(value):
+    return str(value).lower() in ("1", "true", "yes")
+
+
+class Setting:
+    """Configuração lida do ambiente (ou do monitor.env) quando é acessada."""
+
+    def __init__(self, name, default=None, cast=None):
+        self.name = name
+        self.default = default
+        self.cast = cast
+
+    def __get__(self, instance, owner):
+        load_env()
+        value = os.getenv(self.name, self.default)
+        if self.cast and value is not None:
+            return self.cast(value)
+        return value
+
 
 class Config:
-    SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-    SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
-    EMAIL_USER = os.getenv("EMAIL_USER")
-    EMAIL_PASS = os.getenv("EMAIL_PASS")
-    EMAIL_TO = os.getenv("EMAIL_TO")
+    SMTP_SERVER = Setting("SMTP_SERVER", "smtp.gmail.com")
+    SMTP_PORT = Setting("SMTP_PORT", 587, int)
+    EMAIL_USER = Setting("EMAIL_USER")
+    EMAIL_PASS = Setting("EMAIL_PASS")
+    EMAIL_TO = Setting("EMAIL_TO")
+    # STARTTLS pode ser desligado para servidores SMTP locais (testes)
+    SMTP_STARTTLS = Setting("SMTP_STARTTLS", "1", as_bool)
+    SMTP_TIMEOUT = Setting("SMTP_TIMEOUT", 30, float)
+
+    # Fila de alertas: um único e-mail de resumo por execução e tentativas de reenvio
+    EMAIL_DIGEST = Setting("EMAIL_DIGEST", "0", as_bool)
+    EMAIL_MAX_ATTEMPTS = Setting("EMAIL_MAX_ATTEMPTS", 3, int)
+    EMAIL_RETRY_DELAY = Setting("EMAIL_RETRY_DELAY", 5, float)
+
+    # Modo concorrente: total de buscas simultâneas e limite por farmácia (host)
+    MAX_WORKERS = Setting("MAX_WORKERS", 6, int)
+    HOST_CONCURRENCY = Setting("HOST_CONCURRENCY", 2, int)
+
+    # Limite adaptativo por host: taxa inicial (req/s), rajada e limites da adaptação
+    RATE_LIMIT_PER_SECOND = Setting("RATE_LIMIT_PER_SECOND", 1.0, float)
+    RATE_LIMIT_BURST = Setting("RATE_LIMIT_BURST", 2, int)
+    RATE_LIMIT_MIN = Setting("RATE_LIMIT_MIN", 0.1, float)
+    RATE_LIMIT_MAX = Setting("RATE_LIMIT_MAX", 5.0, float)
+
+    # Histórico de preços: "changes" grava uma linha só quando a oferta muda
+    # (first_seen/last_seen marcam o período); "all" grava todas as ofertas a cada execução
+    HISTORY_MODE = Setting("HISTORY_MODE", "changes")
+
+    # Busca paginada: para de pedir páginas ao juntar este número de ofertas em estoque
+    SEARCH_MAX_OFFERS = Setting("SEARCH_MAX_OFFERS", 24, int)
+
+    # Otimizador de carrinho: até quantas caixas cotar por oferta nas farmácias VTEX
+    # (promoções progressivas e frete grátis); pode ser limitado por produto com "max_boxes"
+    CART_MAX_BOXES = Setting("CART_MAX_BOXES", 3, int)
+
+    # Circuit breaker por host: falhas seguidas para abrir e espera (segundos) até nova tentativa,
+    # dobrada a cada tentativa que falha, até o máximo
+    CIRCUIT_FAILURE_THRESHOLD = Setting("CIRCUIT_FAILURE_THRESHOLD", 3, int)
+    CIRCUIT_COOLDOWN_SECONDS = Setting("CIRCUIT_COOLDOWN_SECONDS", 900, float)
+    CIRCUIT_MAX_COOLDOWN_SECONDS = Setting("CIRCUIT_MAX_COOLDOWN_SECONDS", 6 * 3600, float)
+
+    # Cache de frete: validade padrão (horas) e tamanho máximo da tabela
+    SHIPPING_CACHE_TTL_HOURS = Setting("SHIPPING_CACHE_TTL_HOURS", 24, float)
+    SHIPPING_CACHE_MAX_ENTRIES = Setting("SHIPPING_CACHE_MAX_ENTRIES", 10000, int)
+
+    # Drogasil: páginas de produto (PDP) consultadas em paralelo e cache curto por URL
+    PDP_WORKERS = Setting("PDP_WORKERS", 4, int)
+    PDP_CACHE_TTL_SECONDS = Setting("PDP_CACHE_TTL_SECONDS", 900, int)
+
+    # Diretório onde cada execução grava run_metrics.json e o textfile do Prometheus
+    METRICS_DIR = Setting("METRICS_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "metrics"))
+
+    # Diretório da exportação colunar do histórico (python main.py db export)
+    COLUMNAR_DIR = Setting("COLUMNAR_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "history_columnar"))
+
+    # Modo daemon: intervalo padrão entre verificações de um produto (check_every),
+    # folga em relação ao alvo que acelera a verificação e intervalo para checar o config.json
+    DAEMON_CHECK_EVERY = Setting("DAEMON_CHECK_EVERY", "6h")
+    DAEMON_NEAR_THRESHOLD = Setting("DAEMON_NEAR_THRESHOLD", 0.1, float)
+    DAEMON_POLL_SECONDS = Setting("DAEMON_POLL_SECONDS", 30, float)
+
+    @staticmethod
+    def products_path():
+        return os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.json")
+
+    @staticmethod
+    def products_mtime():
+        """Data de modificação do config.json (None se não existir), para recarregá-lo no daemon."""
+        try:
+            return os.path.getmtime(Config.products_path())
+        except OSError:
+            return None
 
     @staticmethod
     def load_products():
-        config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.json")
+        config_path = Config.products_path()
         if not os.path.exists(config_path):
             return {"cep": "01001000", "products": []}
         with open(config_path, "r") as f:
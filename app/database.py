@@ -1,14 +1,46 @@
 import sqlite3
-from datetime import datetime
+from array import array
+import threading
+from datetime import datetime, timedelta
 import os
+from app.metrics import metrics
+from app.columnar import ColumnarExport
 
 class Database:
-    def __init__(self, db_name="prices.db"):
+    # Colunas que definem o "valor" de uma oferta no histórico: uma nova linha só é gravada
+    # (no modo "changes") quando alguma delas muda
+    HISTORY_VALUE_COLUMNS = (
+        "unit_price", "total_price", "shipping_cost", "total_effective_price",
+        "is_kit", "kit_size", "is_best_offer", "notified",
+    )
+
+    def __init__(self, db_name="prices.db", history_mode="all"):
+        """
+        `history_mode`: "all" grava uma linha por oferta a cada execução; "changes" só grava
+        quando os valores mudam e, caso contrário, atualiza o last_seen da última linha.
+        """
+        self.history_mode = history_mode
         self.db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), db_name)
+        # Uma única conexão para toda a execução, compartilhada entre threads (protegida pelo lock)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self.lock = threading.RLock()
+        self.configure_connection()
         self.init_db()
 
+    def configure_connection(self):
+        cursor = self.conn.cursor()
+        # WAL permite leitores simultâneos durante a gravação; NORMAL evita fsync a cada commit
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-20000")  # ~20 MB
+        cursor.execute("PRAGMA temp_store=MEMORY")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self.lock, self.conn as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS price_history (
@@ -30,29 +62,290 @@ class Database:
             try:
                 cursor.execute("ALTER TABLE price_history ADD COLUMN total_price REAL")
             except sqlite3.OperationalError:
-                pass 
+                pass
 
             try:
                 cursor.execute("ALTER TABLE price_history ADD COLUMN notified BOOLEAN DEFAULT 0")
             except sqlite3.OperationalError:
                 pass
-            conn.commit()
+
+            # Período em que a oferta foi vista com os mesmos valores (modo "changes") e
+            # produto do config.json ao qual a oferta pertence (usado nos relatórios)
+            for column, kind in (("first_seen", "DATETIME"), ("last_seen", "DATETIME"), ("monitored_product", "TEXT")):
+                try:
+                    cursor.execute(f"ALTER TABLE price_history ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError:
+                    pass
+
+            # Cache de cotações de frete por (farmácia, sku, CEP)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS shipping_cache (
+                    pharmacy TEXT,
+                    sku TEXT,
+                    cep TEXT,
+                    shipping_cost REAL,
+                    fetched_at DATETIME,
+                    PRIMARY KEY (pharmacy, sku, cep)
+                )
+            """)
+
+            # Índice para a consulta de último preço. A mesma oferta pode pertencer a dois
+            # produtos do config, por isso a última linha é buscada por (farmácia, título,
+            # produto); o índice antigo, sem o produto, é substituído
+            cursor.execute("DROP INDEX IF EXISTS idx_price_history_pharmacy_product")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_price_history_offer
+                ON price_history (pharmacy, product_name, monitored_product, timestamp)
+            """)
+            # O último alerta é lido da tabela last_alert; o índice por notified só encarecia
+            # as gravações do histórico
+            cursor.execute("DROP INDEX IF EXISTS idx_price_history_notified")
+            # Relatórios filtram por período
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_price_history_timestamp
+                ON price_history (timestamp)
+            """)
+
+            # Último alerta enviado por produto do config.json (monitored_product), mantido a cada
+            # gravação com notified=1; `price` é o preço por caixa com frete, o mesmo comparado
+            # em evaluate_product
+            self._create_last_alert(cursor)
+
+            # Métricas de cada execução (uma linha por etapa/farmácia)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS run_metrics (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    run_started DATETIME,
+                    run_finished DATETIME,
+                    stage TEXT,
+                    pharmacy TEXT,
+                    count INTEGER,
+                    errors INTEGER,
+                    bytes INTEGER,
+                    items INTEGER,
+                    total_seconds REAL,
+                    p50_seconds REAL,
+                    p95_seconds REAL,
+                    max_seconds REAL
+                )
+            """)
+
+            # Fila de alertas por e-mail: enfileirados durante a execução e enviados no final
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS alert_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at DATETIME,
+                    product_name TEXT,
+                    pharmacy TEXT,
+                    price REAL,
+                    url TEXT,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    sent_at DATETIME
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_alert_outbox_status
+                ON alert_outbox (status, id)
+            """)
+
+            # Estado do circuit breaker por host, mantido entre execuções
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS circuit_breaker (
+                    host TEXT PRIMARY KEY,
+                    state TEXT,
+                    failures INTEGER,
+                    opened_at DATETIME,
+                    cooldown_seconds REAL,
+                    last_error TEXT,
+                    updated_at DATETIME
+                )
+            """)
+
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version < 1:
+                # Migração: preenche last_alert a partir do histórico já existente
+                self._backfill_last_alert(cursor)
+                cursor.execute("PRAGMA user_version = 1")
+            if version < 2:
+                # Migração: linhas antigas foram vistas uma única vez, no próprio timestamp
+                cursor.execute("""
+                    UPDATE price_history SET first_seen = timestamp, last_seen = timestamp
+                    WHERE first_seen IS NULL
+                """)
+                cursor.execute("PRAGMA user_version = 2")
+            if 1 <= version < 3:
+                # Migração: last_alert era indexado pelo título da oferta e guardava o preço
+                # unitário; passa a usar o produto do config e o preço por caixa com frete
+                cursor.execute("DROP TABLE last_alert")
+                self._create_last_alert(cursor)
+                self._backfill_last_alert(cursor)
+            if version < 3:
+                cursor.execute("PRAGMA user_version = 3")
+
+    def _create_last_alert(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS last_alert (
+                product_name TEXT PRIMARY KEY,
+                pharmacy TEXT,
+                price REAL,
+                timestamp DATETIME
+            )
+        """)
+
+    def _backfill_last_alert(self, cursor):
+        cursor.execute("""
+            INSERT OR REPLACE INTO last_alert (product_name, pharmacy, price, timestamp)
+            SELECT product, pharmacy, price, timestamp FROM (
+                SELECT COALESCE(monitored_product, product_name) AS product, pharmacy,
+                       total_price + COALESCE(shipping_cost, 0) AS price, timestamp,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY COALESCE(monitored_product, product_name) ORDER BY timestamp DESC
+                       ) AS rn
+                FROM price_history WHERE notified = 1
+            ) WHERE rn = 1
+        """)
 
     def save_price(self, pharmacy, product_name, unit_price, total_price, shipping_cost, total_effective_price, is_kit=False, kit_size=1, is_best_offer=False, notified=False):
-        with sqlite3.connect(self.db_path) as conn:
+        self.save_prices([{
+            "pharmacy": pharmacy,
+            "product_name": product_name,
+            "unit_price": unit_price,
+            "total_price": total_price,
+            "shipping_cost": shipping_cost,
+            "total_effective_price": total_effective_price,
+            "is_kit": is_kit,
+            "kit_size": kit_size,
+            "is_best_offer": is_best_offer,
+            "notified": notified,
+        }])
+
+    def save_prices(self, offers, timestamp=None):
+        """
+        Grava várias ofertas em uma única transação.
+        Cada oferta é um dict com as mesmas chaves dos argumentos de save_price.
+        `timestamp` é o horário da execução (padrão: agora); os lotes de uma mesma execução
+        devem usar o mesmo, já que os relatórios agrupam as linhas por timestamp.
+        """
+        if not offers: return
+        now = timestamp or datetime.now()
+        rows = [(
+            now,
+            offer["pharmacy"],
+            offer["product_name"],
+            offer["unit_price"],
+            offer["total_price"],
+            offer["shipping_cost"],
+            offer["total_effective_price"],
+            offer.get("is_kit", False),
+            offer.get("kit_size", 1),
+            offer.get("is_best_offer", False),
+            offer.get("notified", False),
+            now,
+            now,
+            offer.get("monitored_product"),
+        ) for offer in offers]
+        with metrics.track("db_write") as sample, self.lock, self.conn as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO price_history 
-                (timestamp, pharmacy, product_name, unit_price, total_price, shipping_cost, total_effective_price, is_kit, kit_size, is_best_offer, notified)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (datetime.now(), pharmacy, product_name, unit_price, total_price, shipping_cost, total_effective_price, is_kit, kit_size, is_best_offer, notified))
-            conn.commit()
+            unchanged = []
+            if self.history_mode == "changes":
+                rows, unchanged = self._split_unchanged(cursor, rows)
+            sample["items"] = len(rows)
+            cursor.executemany("""
+                INSERT INTO price_history
+                (timestamp, pharmacy, product_name, unit_price, total_price, shipping_cost, total_effective_price, is_kit, kit_size, is_best_offer, notified, first_seen, last_seen, monitored_product)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            if unchanged:
+                cursor.executemany("UPDATE price_history SET last_seen = ? WHERE id = ?",
+                                   [(now, row_id) for row_id in unchanged])
+            # Chave: produto do config (ou o título, em gravações sem ele); valor: preço por caixa com frete
+            alerts = [(row[13] or row[2], row[1], row[4] + (row[5] or 0), row[0]) for row in rows if row[10]]
+            if alerts:
+                cursor.executemany("""
+                    INSERT OR REPLACE INTO last_alert (product_name, pharmacy, price, timestamp)
+                    VALUES (?, ?, ?, ?)
+                """, alerts)
 
-    def get_last_price(self, pharmacy, product_name):
-        with sqlite3.connect(self.db_path) as conn:
+    def _split_unchanged(self, cursor, rows):
+        """
+        Separa as ofertas cujos valores são iguais aos da última linha gravada para a mesma
+        (farmácia, título, produto do config). Retorna (linhas a inserir, ids das linhas que só ganham last_seen).
+        Alertas (notified) sempre geram uma nova linha.
+        """
+        columns = ", ".join(self.HISTORY_VALUE_COLUMNS)
+        to_insert, unchanged = [], []
+        for row in rows:
+            cursor.execute(f"""
+                SELECT id, {columns} FROM price_history
+                WHERE pharmacy = ? AND product_name = ? AND monitored_product IS ?
+                ORDER BY timestamp DESC LIMIT 1
+            """, (row[1], row[2], row[13]))
+            last = cursor.fetchone()
+            if last and not row[10] and _history_values(last[1:]) == _history_values(row[3:11]):
+                unchanged.append(last[0])
+            else:
+                to_insert.append(row)
+        return to_insert, unchanged
+
+    def compact_history(self, vacuum=True):
+        """
+        Reescreve o histórico no formato "changes": linhas consecutivas com os mesmos valores
+        para a mesma (farmácia, título, produto do config) viram uma só, com first_seen/last_seen cobrindo o
+        período. Linhas de alerta (notified) são mantidas. Retorna (linhas antes, linhas depois).
+        """
+        columns = ", ".join(self.HISTORY_VALUE_COLUMNS)
+        with self.lock, self.conn as conn:
             cursor = conn.cursor()
+            before = cursor.execute("SELECT COUNT(*) FROM price_history").fetchone()[0]
+            cursor.execute(f"""
+                SELECT id, pharmacy, product_name, monitored_product, timestamp, first_seen, last_seen, {columns}
+                FROM price_history ORDER BY pharmacy, product_name, monitored_product, timestamp, id
+            """)
+            deleted, extended = array("q"), {}
+            kept = None  # (id, chave, valores) da linha que absorve as seguintes
+            # O cursor é percorrido linha a linha (sem fetchall), para não carregar a tabela
+            # inteira na memória; os ids removidos ficam num array compacto e as remoções só
+            # são aplicadas depois da leitura
+            for row in cursor:
+                row_id, key, last_seen = row[0], (row[1], row[2], row[3]), row[6] or row[4]
+                values = _history_values(row[7:])
+                notified = row[-1]
+                if kept and kept[1] == key and kept[2] == values and not notified:
+                    deleted.append(row_id)
+                    extended[kept[0]] = last_seen
+                else:
+                    kept = (row_id, key, values)
+            cursor.executemany("DELETE FROM price_history WHERE id = ?", ((row_id,) for row_id in deleted))
+            cursor.executemany("UPDATE price_history SET last_seen = ? WHERE id = ?",
+                               [(last_seen, row_id) for row_id, last_seen in extended.items()])
+        if vacuum:
+            self.vacuum()
+        return before, before - len(deleted)
+
+    def vacuum(self):
+        """Devolve ao disco o espaço das linhas apagadas (VACUUM precisa rodar fora de transação)."""
+        with self.lock:
+            self.conn.execute("VACUUM")
+            # Em WAL, o arquivo principal só encolhe depois do checkpoint
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def export_columnar(self, directory, full=False, chunk_size=50000):
+        """
+        Exporta o histórico em formato colunar (ver app/columnar.py), apenas com as linhas
+        novas desde a última exportação. Retorna (linhas novas, total exportado).
+        """
+        with metrics.track("columnar_export") as sample:
+            added, total = ColumnarExport(self, directory, chunk_size).run(full=full)
+            sample["items"] = added
+        return added, total
+
+    def get_last_price(self, pharmacy, product_name):
+        with self.lock:
+            cursor = self.conn.cursor()
             cursor.execute("""
-                SELECT total_effective_price FROM price_history 
+                SELECT total_effective_price FROM price_history
                 WHERE pharmacy = ? AND product_name = ?
                 ORDER BY timestamp DESC LIMIT 1
             """, (pharmacy, product_name))
@@ -61,17 +354,159 @@ class Database:
 
     def get_last_notified_offer(self, product_name):
         """
-        Retorna a farmácia e o preço efetivo total do último alerta enviado para este produto.
-        Serve para evitar envios duplicados se nada mudou.
+        Retorna a farmácia e o preço por caixa (com frete) do último alerta enviado para este
+        produto do config.json. Serve para evitar envios duplicados se nada mudou.
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        with self.lock:
+            cursor = self.conn.cursor()
             cursor.execute("""
-                SELECT pharmacy, total_effective_price FROM price_history 
-                WHERE product_name = ? AND notified = 1
-                ORDER BY timestamp DESC LIMIT 1
+                SELECT pharmacy, price FROM last_alert
+                WHERE product_name = ?
             """, (product_name,))
             result = cursor.fetchone()
             if result:
                 return {"pharmacy": result[0], "price": result[1]}
             return None
+
+    def get_cached_shipping(self, pharmacy, skus, cep, max_age_hours):
+        """Retorna {sku: frete} das cotações em cache mais novas que `max_age_hours`."""
+        if not skus: return {}
+        cutoff = datetime.now() - timedelta(hours=max_age_hours)
+        placeholders = ",".join("?" for _ in skus)
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(f"""
+                SELECT sku, shipping_cost FROM shipping_cache
+                WHERE pharmacy = ? AND cep = ? AND fetched_at >= ? AND sku IN ({placeholders})
+            """, (pharmacy, cep, cutoff, *skus))
+            return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def save_shipping_quotes(self, pharmacy, cep, quotes):
+        """Grava (ou atualiza) as cotações de frete {sku: frete} no cache."""
+        if not quotes: return
+        now = datetime.now()
+        with self.lock, self.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT OR REPLACE INTO shipping_cache (pharmacy, sku, cep, shipping_cost, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(pharmacy, sku, cep, cost, now) for sku, cost in quotes.items()])
+
+    def evict_shipping_cache(self, max_age_hours, max_entries):
+        """Remove cotações mais velhas que `max_age_hours` e mantém só as `max_entries` mais recentes."""
+        cutoff = datetime.now() - timedelta(hours=max_age_hours)
+        with self.lock, self.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM shipping_cache WHERE fetched_at < ?", (cutoff,))
+            removed = cursor.rowcount
+            cursor.execute("""
+                DELETE FROM shipping_cache WHERE rowid NOT IN (
+                    SELECT rowid FROM shipping_cache ORDER BY fetched_at DESC LIMIT ?
+                )
+            """, (max_entries,))
+            removed += cursor.rowcount
+            return removed
+
+    def invalidate_shipping_cache(self, pharmacy=None):
+        """Apaga o cache de frete de uma farmácia (ou de todas, se `pharmacy` for None)."""
+        with self.lock, self.conn as conn:
+            cursor = conn.cursor()
+            if pharmacy:
+                cursor.execute("DELETE FROM shipping_cache WHERE pharmacy = ?", (pharmacy,))
+            else:
+                cursor.execute("DELETE FROM shipping_cache")
+            return cursor.rowcount
+
+    def save_run_metrics(self, summary):
+        """Grava o resumo de Metrics.summary() na tabela run_metrics."""
+        rows = [(
+            summary["started_at"],
+            summary["finished_at"],
+            stage["stage"],
+            stage["pharmacy"],
+            stage["count"],
+            stage["errors"],
+            stage["bytes"],
+            stage["items"],
+            stage["total_seconds"],
+            stage["p50_seconds"],
+            stage["p95_seconds"],
+            stage["max_seconds"],
+        ) for stage in summary["stages"]]
+        if not rows: return
+        with self.lock, self.conn as conn:
+            conn.executemany("""
+                INSERT INTO run_metrics
+                (run_started, run_finished, stage, pharmacy, count, errors, bytes, items, total_seconds, p50_seconds, p95_seconds, max_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+    def get_circuit_states(self):
+        """[(host, estado, falhas, aberto em, cooldown, último erro)] salvos pelo circuit breaker."""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("""
+                SELECT host, state, failures, opened_at, cooldown_seconds, last_error FROM circuit_breaker
+            """)
+            return cursor.fetchall()
+
+    def save_circuit_state(self, host, state, failures, opened_at, cooldown_seconds, last_error):
+        with self.lock, self.conn as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO circuit_breaker
+                (host, state, failures, opened_at, cooldown_seconds, last_error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (host, state, failures, opened_at, cooldown_seconds, last_error, datetime.now()))
+
+    def enqueue_alert(self, product_name, pharmacy, price, url):
+        """Enfileira um alerta e retorna o id dele na alert_outbox."""
+        with self.lock, self.conn as conn:
+            cursor = conn.execute("""
+                INSERT INTO alert_outbox (created_at, product_name, pharmacy, price, url)
+                VALUES (?, ?, ?, ?, ?)
+            """, (datetime.now(), product_name, pharmacy, price, url))
+            return cursor.lastrowid
+
+    def get_pending_alerts(self):
+        """Alertas ainda não enviados, do mais antigo ao mais novo."""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("""
+                SELECT id, product_name, pharmacy, price, url, attempts FROM alert_outbox
+                WHERE status = 'pending'
+                ORDER BY id
+            """)
+            return [{
+                "id": row[0],
+                "product_name": row[1],
+                "pharmacy": row[2],
+                "price": row[3],
+                "url": row[4],
+                "attempts": row[5],
+            } for row in cursor.fetchall()]
+
+    def mark_alerts(self, ids, status, error=None, max_attempts=None):
+        """
+        Registra o resultado de uma tentativa de envio: 'sent', 'skipped' ou 'pending'
+        (falha: conta mais uma tentativa e guarda o erro; ao atingir `max_attempts`
+        o alerta passa para 'failed').
+        """
+        if not ids: return
+        now = datetime.now()
+        with self.lock, self.conn as conn:
+            if status == "pending":
+                conn.executemany("""
+                    UPDATE alert_outbox
+                    SET attempts = attempts + 1, last_error = ?,
+                        status = CASE WHEN ? IS NOT NULL AND attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+                    WHERE id = ?
+                """, [(error, max_attempts, max_attempts, alert_id) for alert_id in ids])
+            else:
+                conn.executemany("""
+                    UPDATE alert_outbox SET status = ?, sent_at = ?, last_error = ? WHERE id = ?
+                """, [(status, now, error, alert_id) for alert_id in ids])
+
+
+def _history_values(values):
+    # Booleanos voltam do SQLite como inteiros; normaliza para comparar com o que vai ser gravado
+    return tuple(int(v) if isinstance(v, bool) else v for v in values)
@@ -0,0 +1,102 @@
+import json
+
+try:
+    import orjson
+
+    def loads(data):
+        """Decodifica JSON com orjson (bem mais rápido); aceita str, bytes ou memoryview."""
+        return orjson.loads(data)
+except ImportError:
+    def loads(data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+def script_contents(body, marker):
+    """
+    Gera o conteúdo (memoryview, sem cópia) de cada <script> cuja tag de abertura
+    contém `marker` (ex.: b"__NEXT_DATA__", b"application/ld+json").
+    Procura direto nos bytes da resposta, sem decodificar nem montar o DOM.
+    """
+    view = memoryview(body)
+    start = 0
+    while True:
+        pos = body.find(marker, start)
+        if pos < 0:
+            return
+        tag_start = body.rfind(b"<script", 0, pos)
+        tag_end = body.find(b">", pos)
+        # O marcador precisa estar dentro da tag de abertura, não no conteúdo de outro script
+        if tag_start < 0 or tag_end < 0 or body.find(b">", tag_start, pos) >= 0:
+            start = pos + len(marker)
+            continue
+        close = body.find(b"</script", tag_end)
+        if close < 0:
+            return
+        yield view[tag_end + 1:close]
+        start = close
+
+
+def first_script(body, marker):
+    return next(script_contents(body, marker), None)
+
+
+class JsonIndex:
+    """
+    Percorre um payload JSON uma única vez e indexa chave -> [(caminho, valor)].
+
+    A ordem das entradas é a mesma da busca recursiva em profundidade (o dict é
+    examinado antes dos seus filhos), então `first()` devolve o mesmo valor que o
+    antigo find_field devolvia, sem percorrer o documento de novo a cada campo.
+    """
+
+    def __init__(self, payload, keys=None):
+        self.keys = set(keys) if keys is not None else None
+        self.entries = {}
+        self._build(payload)
+
+    def _build(self, payload):
+        keys = self.keys
+        entries = self.entries
+        # Pilha explícita para evitar recursão em documentos grandes
+        stack = [(payload, ())]
+        while stack:
+            obj, path = stack.pop()
+            if isinstance(obj, dict):
+                children = []
+                for key, value in obj.items():
+                    if keys is None or key in keys:
+                        entries.setdefault(key, []).append((path + (key,), value))
+                    if isinstance(value, (dict, list)):
+                        children.append((value, path + (key,)))
+                stack.extend(reversed(children))
+            elif isinstance(obj, list):
+                stack.extend(
+                    (item, path + (i,))
+                    for i, item in reversed(list(enumerate(obj)))
+                    if isinstance(item, (dict, list))
+                )
+
+    def first(self, key, predicate=None):
+        """
+        Primeiro valor não vazio da chave (opcionalmente filtrado por `predicate`).
+        Como na busca recursiva, um dict cuja chave existe (e passa no filtro) mas
+        está vazia encerra a busca dentro dele: o que está aninhado abaixo é ignorado.
+        """
+        shadowed = []
+        for path, value in self.entries.get(key, ()):
+            if any(path[:len(owner)] == owner for owner in shadowed):
+                continue
+            if predicate is not None and not predicate(value):
+                continue
+            if value:
+                return value
+            shadowed.append(path[:-1])
+        return None
+
+    def all(self, key):
+        return [value for _, value in self.entries.get(key, ())]
+
+    def paths(self, key):
+        return [path for path, _ in self.entries.get(key, ())]
@@ -0,0 +1,162 @@
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+
+class Metrics:
+    """
+    Contadores, bytes, latências e erros por etapa e farmácia de uma execução.
+    Os scrapers, o banco e o notificador registram tudo no objeto `metrics` deste módulo.
+    """
+
+    PROMETHEUS_PREFIX = "pharma_alert"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.series = {}
+            self.started_at = datetime.now()
+
+    def _series(self, stage, pharmacy):
+        key = (stage, pharmacy or "")
+        if key not in self.series:
+            self.series[key] = {"count": 0, "errors": 0, "bytes": 0, "items": 0, "latencies": []}
+        return self.series[key]
+
+    def observe(self, stage, pharmacy=None, seconds=0.0, nbytes=0, items=0, error=False):
+        with self._lock:
+            series = self._series(stage, pharmacy)
+            series["count"] += 1
+            series["bytes"] += nbytes
+            series["items"] += items
+            series["latencies"].append(seconds)
+            if error:
+                series["errors"] += 1
+
+    @contextmanager
+    def track(self, stage, pharmacy=None):
+        """Mede o bloco; exceções contam como erro e são repassadas."""
+        start = time.perf_counter()
+        sample = {"nbytes": 0, "items": 0, "error": False}
+        try:
+            yield sample
+        except Exception:
+            sample["error"] = True
+            raise
+        finally:
+            self.observe(stage, pharmacy, time.perf_counter() - start, **sample)
+
+    def summary(self):
+        stages = []
+        with self._lock:
+            for (stage, pharmacy), series in sorted(self.series.items()):
+                latencies = sorted(series["latencies"])
+                total = sum(latencies)
+                stages.append({
+                    "stage": stage,
+                    "pharmacy": pharmacy,
+                    "count": series["count"],
+                    "errors": series["errors"],
+                    "error_rate": series["errors"] / series["count"] if series["count"] else 0.0,
+                    "bytes": series["bytes"],
+                    "items": series["items"],
+                    "total_seconds": total,
+                    "p50_seconds": _quantile(latencies, 0.5),
+                    "p95_seconds": _quantile(latencies, 0.95),
+                    "max_seconds": latencies[-1] if latencies else 0.0,
+                })
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "stages": stages,
+        }
+
+    def write_json(self, path, summary=None):
+        _atomic_write(path, json.dumps(summary or self.summary(), indent=2, ensure_ascii=False))
+
+    def write_prometheus(self, path, summary=None):
+        """Exporta no formato textfile do node_exporter."""
+        summary = summary or self.summary()
+        p = self.PROMETHEUS_PREFIX
+        metrics = [
+            ("requests_total", "counter", "Operações executadas", "count"),
+            ("errors_total", "counter", "Operações com erro", "errors"),
+            ("bytes_total", "counter", "Bytes recebidos", "bytes"),
+            ("items_total", "counter", "Itens processados (linhas gravadas, alertas etc.)", "items"),
+            ("latency_seconds_sum", "counter", "Tempo total gasto na etapa", "total_seconds"),
+        ]
+        lines = []
+        for name, kind, help_text, field in metrics:
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {kind}")
+            for s in summary["stages"]:
+                lines.append(f'{p}_{name}{{stage="{s["stage"]}",pharmacy="{_escape(s["pharmacy"])}"}} {s[field]}')
+        lines.append(f"# HELP {p}_latency_seconds Latência por etapa")
+        lines.append(f"# TYPE {p}_latency_seconds gauge")
+        for s in summary["stages"]:
+            labels = f'stage="{s["stage"]}",pharmacy="{_escape(s["pharmacy"])}"'
+            lines.append(f'{p}_latency_seconds{{{labels},quantile="0.5"}} {s["p50_seconds"]}')
+            lines.append(f'{p}_latency_seconds{{{labels},quantile="0.95"}} {s["p95_seconds"]}')
+        lines.append(f"# HELP {p}_last_run_timestamp_seconds Fim da última execução")
+        lines.append(f"# TYPE {p}_last_run_timestamp_seconds gauge")
+        lines.append(f"{p}_last_run_timestamp_seconds {time.time():.0f}")
+        _atomic_write(path, "\n".join(lines) + "\n")
+
+    def export(self, directory, db=None):
+        """Grava o resumo em JSON, o textfile do Prometheus e a tabela run_metrics."""
+        summary = self.summary()
+        os.makedirs(directory, exist_ok=True)
+        self.write_json(os.path.join(directory, "run_metrics.json"), summary)
+        self.write_prometheus(os.path.join(directory, "pharma_alert.prom"), summary)
+        if db is not None:
+            db.save_run_metrics(summary)
+        return summary
+
+
+def _quantile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _atomic_write(path, content):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def timed(stage):
+    """
+    Decorador para métodos dos scrapers: registra a etapa sob a farmácia do scraper.
+    Em geradores, mede do início ao fim da iteração.
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @wraps(func)
+            def generator_wrapper(self, *args, **kwargs):
+                with metrics.track(stage, getattr(self, "pharmacy", None)):
+                    yield from func(self, *args, **kwargs)
+            return generator_wrapper
+
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with metrics.track(stage, getattr(self, "pharmacy", None)):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+metrics = Metrics()
@@ -1,14 +1,12 @@
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import time
 from app.config import Config
+from app.metrics import metrics
 
 class Notifier:
     @staticmethod
-    def send_alert(product_name, pharmacy, price, url):
-        if not Config.EMAIL_USER or not Config.EMAIL_PASS:
-            print("Email credentials not configured. Skipping alert.")
-            return
+    def build_message(product_name, pharmacy, price, url):
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
 
         msg = MIMEMultipart()
         msg['From'] = Config.EMAIL_USER
@@ -17,24 +15,199 @@ class Notifier:
 
         body = f"""
         Olá!
-        
+
         O preço do medicamento {product_name} baixou na {pharmacy}!
-        
+
         Preço da Caixa (com frete/kit): R$ {price:.2f}
         Link: {url}
-        
+
         ---
         Monitor de Preços Automático
         """
         msg.attach(MIMEText(body, 'plain'))
+        return msg
 
-        try:
-            server = smtplib.SMTP(Config.SMTP_SERVER, Config.SMTP_PORT)
+    @staticmethod
+    def build_digest(alerts):
+        """Um único e-mail com todos os alertas da execução."""
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+
+        msg = MIMEMultipart()
+        msg['From'] = Config.EMAIL_USER
+        msg['To'] = Config.EMAIL_TO
+        msg['Subject'] = f"🚨 ALERTA DE PREÇO: {len(alerts)} medicamentos baixaram de preço"
+
+        lines = [
+            f"- {alert['product_name']} na {alert['pharmacy']}: R$ {alert['price']:.2f}\n  {alert['url']}"
+            for alert in alerts
+        ]
+        body = "Olá!\n\nOs preços abaixo atingiram o alvo:\n\n" + "\n".join(lines) + "\n\n---\nMonitor de Preços Automático\n"
+        msg.attach(MIMEText(body, 'plain'))
+        return msg
+
+    @staticmethod
+    def connect():
+        """Abre (e autentica) uma sessão SMTP, reaproveitada para todos os envios da fila."""
+        # smtplib/email só são carregados quando há alerta para enviar
+        import smtplib
+
+        server = smtplib.SMTP(Config.SMTP_SERVER, Config.SMTP_PORT, timeout=Config.SMTP_TIMEOUT)
+        if Config.SMTP_STARTTLS:
             server.starttls()
+        # Servidores locais de teste costumam não ter AUTH: nesse caso envia sem login
+        server.ehlo_or_helo_if_needed()
+        if server.has_extn("auth"):
             server.login(Config.EMAIL_USER, Config.EMAIL_PASS)
-            text = msg.as_string()
-            server.sendmail(Config.EMAIL_USER, Config.EMAIL_TO, text)
-            server.quit()
-            print(f"Alerta enviado para {Config.EMAIL_TO}")
-        except Exception as e:
-            print(f"Erro ao enviar email: {e}")
+        return server
+
+    @staticmethod
+    def send_alert(product_name, pharmacy, price, url):
+        if not Config.EMAIL_USER or not Config.EMAIL_PASS:
+            print("Email credentials not configured. Skipping alert.")
+            return
+
+        msg = Notifier.build_message(product_name, pharmacy, price, url)
+
+        with metrics.track("send_alert", pharmacy) as sample:
+            try:
+                server = Notifier.connect()
+                text = msg.as_string()
+                server.sendmail(Config.EMAIL_USER, Config.EMAIL_TO, text)
+                server.quit()
+                sample["items"] = 1
+                print(f"Alerta enviado para {Config.EMAIL_TO}")
+            except Exception as e:
+                sample["error"] = True
+                print(f"Erro ao enviar email: {e}")
+
+
+class Outbox:
+    """
+    Fila de alertas persistida na tabela alert_outbox do prices.db.
+    Cada alerta novo é enviado assim que o produto fica pronto, por uma sessão SMTP aberta
+    no primeiro envio e reaproveitada até o flush() do fim da execução, que tenta de novo
+    as falhas (inclusive as pendentes de execuções anteriores) e fecha a sessão. Se o
+    servidor não responder durante a busca, os envios ficam todos para o flush(), sem gastar
+    tentativas. No modo resumo (`digest`) tudo sai num único e-mail no flush().
+    Cada alerta tem até `max_attempts` tentativas; depois disso fica como 'failed'.
+    """
+
+    def __init__(self, db, digest=False, max_attempts=3, retry_delay=5.0):
+        self.db = db
+        self.digest = digest
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.server = None
+        # Conexão falhou durante a busca: não tenta mais até o flush()
+        self.deferred = False
+
+    def add(self, product_name, pharmacy, price, url):
+        alert_id = self.db.enqueue_alert(product_name, pharmacy, price, url)
+        print(f"  Alerta enfileirado: {product_name} na {pharmacy} por R$ {price:.2f}")
+        if self.digest or self.deferred or not Config.EMAIL_USER or not Config.EMAIL_PASS:
+            return
+        alert = {"id": alert_id, "product_name": product_name, "pharmacy": pharmacy, "price": price, "url": url}
+        self._deliver([alert], during_run=True)
+
+    def flush(self):
+        self.deferred = False
+        pending = self.db.get_pending_alerts()
+        if not pending:
+            self.close()
+            return 0
+        if not Config.EMAIL_USER or not Config.EMAIL_PASS:
+            print("Email credentials not configured. Skipping alert.")
+            self.db.mark_alerts([alert["id"] for alert in pending], "skipped", "sem credenciais")
+            return 0
+
+        sent = 0
+        try:
+            for attempt in range(self.max_attempts):
+                if attempt:
+                    time.sleep(self.retry_delay * attempt)
+                sent += self._deliver(pending)
+                pending = self.db.get_pending_alerts()
+                if not pending:
+                    break
+        finally:
+            self.close()
+        if pending:
+            print(f"{len(pending)} alerta(s) não enviados ficam na fila para a próxima execução")
+        return sent
+
+    def close(self):
+        """Encerra a sessão SMTP da execução, se houver."""
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+    def _deliver(self, alerts, during_run=False):
+        """
+        Uma tentativa: envia os alertas (ou o resumo) pela sessão SMTP da execução, abrindo-a
+        se preciso. Com `during_run`, falhar ao conectar não conta tentativa: os alertas
+        esperam o flush().
+        """
+        if not alerts:
+            return 0
+        if self.server is None:
+            try:
+                self.server = Notifier.connect()
+            except Exception as e:
+                print(f"Erro ao conectar no servidor SMTP: {e}")
+                if during_run:
+                    self.deferred = True
+                else:
+                    self.db.mark_alerts([alert["id"] for alert in alerts], "pending", str(e), self.max_attempts)
+                return 0
+
+        if self.digest:
+            batches = [(alerts, Notifier.build_digest(alerts))]
+        else:
+            batches = [
+                ([alert], Notifier.build_message(alert["product_name"], alert["pharmacy"], alert["price"], alert["url"]))
+                for alert in alerts
+            ]
+
+        sent = 0
+        for batch, msg in batches:
+            ids = [alert["id"] for alert in batch]
+            pharmacy = batch[0]["pharmacy"] if len(batch) == 1 else None
+            with metrics.track("send_alert", pharmacy) as sample:
+                try:
+                    self._send(msg)
+                    sample["items"] = len(batch)
+                    self.db.mark_alerts(ids, "sent")
+                    sent += len(batch)
+                except Exception as e:
+                    sample["error"] = True
+                    print(f"Erro ao enviar email: {e}")
+                    if self.server is None and during_run:
+                        # Não conseguiu reconectar: fica para o flush(), sem gastar tentativa
+                        self.deferred = True
+                        break
+                    self.db.mark_alerts(ids, "pending", str(e), self.max_attempts)
+                    if self.server is None:
+                        # Sessão perdida: os demais ficam para a próxima tentativa, com nova sessão
+                        break
+        if sent:
+            print(f"{sent} alerta(s) enviados para {Config.EMAIL_TO}")
+        return sent
+
+    def _send(self, msg):
+        """Envia pela sessão aberta; se o servidor derrubou a sessão ociosa, reconecta uma vez e reenvia."""
+        import smtplib
+
+        try:
+            self.server.sendmail(Config.EMAIL_USER, Config.EMAIL_TO, msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            self.server = None
+            self.server = Notifier.connect()
+            try:
+                self.server.sendmail(Config.EMAIL_USER, Config.EMAIL_TO, msg.as_string())
+            except smtplib.SMTPServerDisconnected:
+                self.server = None
+                raise
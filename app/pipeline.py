@@ -0,0 +1,126 @@
+import threading
+from datetime import datetime
+
+
+def history_row(product, offer, is_best=False, notified=False):
+    """Linha do price_history para uma oferta selecionada de um produto."""
+    return {
+        "pharmacy": offer["pharmacy"],
+        "product_name": offer["title"],
+        "unit_price": offer["unit_price"], # Preço unitário puro (sem frete)
+        "total_price": offer["price"],     # Preço total da caixa
+        "shipping_cost": offer["shipping"],
+        "total_effective_price": offer["total_effective_unit"], # Preço unitário com frete proporcional
+        "is_kit": (offer["quantity"] > 1),
+        "kit_size": offer["quantity"],
+        "is_best_offer": is_best,
+        "notified": notified,
+        "monitored_product": product["name"]
+    }
+
+
+class HistoryWriter:
+    """
+    Acumula linhas do histórico e grava em lotes (uma transação por lote), de qualquer thread.
+    Todas as linhas levam o mesmo timestamp, o da criação do writer (início da execução).
+    """
+
+    def __init__(self, db, batch_size=100, timestamp=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.timestamp = timestamp or datetime.now()
+        self.rows = []
+        self._lock = threading.Lock()
+
+    def add(self, row):
+        with self._lock:
+            self.rows.append(row)
+            if len(self.rows) < self.batch_size:
+                return
+            rows, self.rows = self.rows, []
+        self.db.save_prices(rows, self.timestamp)
+
+    def flush(self):
+        with self._lock:
+            rows, self.rows = self.rows, []
+        self.db.save_prices(rows, self.timestamp)
+
+
+class ProductStream:
+    """
+    Melhor oferta corrente de um produto. Só ela fica em memória: as demais (e as que
+    perdem o posto) vão direto para o writer; a vencedora é gravada em finish().
+    """
+
+    def __init__(self, product, writer):
+        self.product = product
+        self.writer = writer
+        self.best = None
+        self.best_rank = None
+        self.offers = 0
+        self._lock = threading.Lock()
+
+    def add(self, offer, sequence=()):
+        """
+        `sequence` é a posição da oferta na ordem do plano (scraper, posição no resultado):
+        em empate de preço fica a primeira nessa ordem, como o min() de antes, mesmo que
+        as buscas terminem em outra ordem no modo concorrente.
+        """
+        rank = (offer["total_effective_unit"], sequence)
+        with self._lock:
+            self.offers += 1
+            if self.best is None or rank < self.best_rank:
+                offer, self.best = self.best, offer
+                self.best_rank = rank
+        if offer is not None:
+            self.writer.add(history_row(self.product, offer))
+
+    def finish(self, notified=False):
+        """Grava a melhor oferta (marcando se o alerta saiu) junto com o que restou no buffer."""
+        if self.best is not None:
+            self.writer.add(history_row(self.product, self.best, is_best=True, notified=notified))
+        self.writer.flush()
+
+
+class OfferPipeline:
+    """
+    Liga as buscas de um SearchPlan aos produtos: cada oferta gerada por um scraper é
+    filtrada para os produtos que compartilham a busca (`select(produto, [oferta])`) e
+    atualiza na hora a melhor oferta de cada um. Um produto fica pronto assim que todas
+    as suas buscas terminam, sem esperar as buscas dos outros produtos.
+    """
+
+    def __init__(self, plan, select, writer):
+        self.select = select
+        # Ordem de cada busca para o desempate: a posição do scraper no plano
+        self.order = {key: plan.scrapers.index(scraper) for key, (scraper, _, _) in plan.searches.items()}
+        self.streams = [ProductStream(product, writer) for product in plan.products]
+        self.streams_by_key = {}
+        self.pending = {}
+        for stream in self.streams:
+            keys = set(plan.keys_for(stream.product))
+            self.pending[id(stream)] = keys
+            for key in keys:
+                self.streams_by_key.setdefault(key, []).append(stream)
+        self._lock = threading.Lock()
+
+    def feed(self, key, offers):
+        """Consome as ofertas de uma busca à medida que o scraper as gera."""
+        streams = self.streams_by_key.get(key, [])
+        order = self.order.get(key, 0)
+        for position, res in enumerate(offers):
+            for stream in streams:
+                for offer in self.select(stream.product, [res]):
+                    stream.add(offer, (order, position))
+
+    def complete(self, key):
+        """Marca a busca como terminada e retorna os produtos que ficaram prontos com ela."""
+        ready = []
+        with self._lock:
+            for stream in self.streams_by_key.get(key, []):
+                pending = self.pending[id(stream)]
+                if key in pending:
+                    pending.discard(key)
+                    if not pending:
+                        ready.append(stream)
+        return ready
@@ -0,0 +1,99 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class TokenBucket:
+    """
+    Token bucket adaptativo para um host.
+    A taxa cai pela metade a cada bloqueio (403/429/503) e volta a subir aos poucos
+    a cada resposta bem-sucedida (aumento aditivo, redução multiplicativa).
+    """
+
+    def __init__(self, rate=1.0, burst=2, min_rate=0.1, max_rate=5.0, increase=0.1, max_backoff=60.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.max_backoff = max_backoff
+        self.tokens = float(burst)
+        self.paused_until = 0.0
+        self.throttles = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Bloqueia até haver um token disponível para este host."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.throttles = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            backoff = retry_after if retry_after else min(self.max_backoff, 2.0 ** self.throttles)
+            self.paused_until = max(self.paused_until, time.monotonic() + backoff)
+
+
+class RateLimiter:
+    """Agenda as requisições de cada host em um TokenBucket próprio."""
+
+    THROTTLE_STATUSES = (403, 429, 503)
+
+    def __init__(self, rate=1.0, burst=2, min_rate=0.1, max_rate=5.0, enabled=True):
+        self.defaults = {"rate": rate, "burst": burst, "min_rate": min_rate, "max_rate": max_rate}
+        self.enabled = enabled
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def unlimited(cls):
+        """Limitador sem espera, para execuções sem rede (replay/benchmark)."""
+        return cls(enabled=False)
+
+    def bucket(self, url):
+        host = urlparse(url).hostname or url
+        with self._lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(**self.defaults)
+            return self.buckets[host]
+
+    def acquire(self, url):
+        if self.enabled:
+            self.bucket(url).acquire()
+
+    def record(self, url, status, retry_after=None):
+        if not self.enabled:
+            return
+        bucket = self.bucket(url)
+        if status in self.THROTTLE_STATUSES:
+            bucket.on_throttle(retry_after)
+            print(f"    Limite de requisições em {urlparse(url).hostname}: status {status}, reduzindo para {bucket.rate:.2f} req/s")
+        elif status is not None and status < 400:
+            bucket.on_success()
+
+    def report(self):
+        print("\nTaxa final por host:")
+        for host, bucket in sorted(self.buckets.items()):
+            print(f"  {host}: {bucket.rate:.2f} req/s")
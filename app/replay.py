@@ -0,0 +1,151 @@
+import base64
+import hashlib
+import json
+import os
+from urllib.parse import urlparse
+from app.sessions import SessionPool
+
+
+class RecordedResponse:
+    """Resposta servida a partir de uma fixture; imita a interface do Scrapling e do httpx."""
+
+    def __init__(self, status, body, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    @property
+    def status_code(self):
+        return self.status
+
+    @property
+    def content(self):
+        return self.body
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8", "ignore")
+
+
+class FixtureStore:
+    """
+    Guarda uma fixture JSON por requisição, identificada pelo canal ("stealth" para o
+    Scrapling, "http" para o fallback httpx), método, URL e corpo enviado.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, channel, method, url, data=None):
+        digest = hashlib.sha1(f"{channel} {method} {url}\n{data or ''}".encode("utf-8")).hexdigest()[:16]
+        host = urlparse(url).hostname or "local"
+        return os.path.join(self.directory, host, f"{channel}-{method.lower()}-{digest}.json")
+
+    def save(self, channel, method, url, data, status, body, headers=None):
+        path = self.key(channel, method, url, data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            content = {"text": body.decode("utf-8")}
+        except UnicodeDecodeError:
+            content = {"base64": base64.b64encode(body).decode("ascii")}
+        fixture = {
+            "channel": channel,
+            "method": method,
+            "url": url,
+            "data": data,
+            "status": status,
+            "headers": {k.lower(): v for k, v in dict(headers or {}).items() if k.lower() == "retry-after"},
+            **content,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=1)
+
+    def load(self, channel, method, url, data=None):
+        path = self.key(channel, method, url, data)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            fixture = json.load(f)
+        if "base64" in fixture:
+            body = base64.b64decode(fixture["base64"])
+        else:
+            body = fixture.get("text", "").encode("utf-8")
+        return RecordedResponse(fixture["status"], body, fixture.get("headers"))
+
+
+def _body_of(response):
+    if hasattr(response, "body"):
+        return response.body or b""
+    return response.content or b""
+
+
+def _status_of(response):
+    return response.status if hasattr(response, "status") else response.status_code
+
+
+class _RecordingSession:
+    def __init__(self, inner, store, channel):
+        self.inner = inner
+        self.store = store
+        self.channel = channel
+
+    def _record(self, method, url, data, response):
+        self.store.save(self.channel, method, url, data, _status_of(response), _body_of(response), getattr(response, "headers", None))
+        return response
+
+    def get(self, url, **kwargs):
+        return self._record("GET", url, None, self.inner.get(url, **kwargs))
+
+    def post(self, url, data=None, **kwargs):
+        return self._record("POST", url, data, self.inner.post(url, data=data, **kwargs))
+
+
+class _ReplaySession:
+    def __init__(self, store, channel):
+        self.store = store
+        self.channel = channel
+
+    def _serve(self, method, url, data):
+        response = self.store.load(self.channel, method, url, data)
+        if response is None:
+            print(f"    [replay] Sem fixture para {method} {url}")
+            return RecordedResponse(404, b"")
+        return response
+
+    def get(self, url, **kwargs):
+        return self._serve("GET", url, None)
+
+    def post(self, url, data=None, **kwargs):
+        return self._serve("POST", url, data)
+
+
+class RecordingSessionPool(SessionPool):
+    """SessionPool que grava em disco todas as respostas vistas pelos scrapers."""
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.store = FixtureStore(directory)
+
+    def stealth(self, url):
+        return _RecordingSession(super().stealth(url), self.store, "stealth")
+
+    def client(self, url):
+        return _RecordingSession(super().client(url), self.store, "http")
+
+
+class ReplaySessionPool:
+    """Serve as respostas gravadas por RecordingSessionPool, sem acessar a rede."""
+
+    def __init__(self, directory):
+        self.store = FixtureStore(directory)
+        self.stealth_session = _ReplaySession(self.store, "stealth")
+        self.http_session = _ReplaySession(self.store, "http")
+
+    def stealth(self, url):
+        return self.stealth_session
+
+    def client(self, url):
+        return self.http_session
+
+    def close(self):
+        pass
@@ -0,0 +1,212 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+
+class PriceReports:
+    """
+    Consultas analíticas sobre o price_history, feitas inteiramente no SQLite com funções
+    de janela (uma passada por consulta, sem carregar o histórico na memória do Python).
+
+    Os relatórios agrupam por (produto, farmácia), onde o produto é o nome do config.json
+    (`monitored_product`) ou, em linhas antigas, o título da oferta. Cada execução é
+    reduzida ao menor preço efetivo da farmácia naquele momento.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def _query(self, sql, params):
+        with self.db.lock:
+            cursor = self.db.conn.cursor()
+            cursor.execute(sql, params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def price_stats(self, days=30, percentile=0.9, product=None):
+        """
+        Por produto e farmácia, no período: dias observados, preço atual, mínimo, mediana,
+        percentil, quedas de preço (e quantas por semana) e o mínimo móvel dos últimos 7 dias.
+
+        Cada preço pesa pelo tempo em que valeu (até a próxima mudança ou até a última vez
+        em que foi visto), e não pelo número de linhas: no HISTORY_MODE=changes uma oferta
+        que ficou semanas sem mudar é uma única linha com last_seen recente.
+        """
+        since = datetime.now() - timedelta(days=days)
+        product_filter = "AND COALESCE(monitored_product, product_name) = ?" if product else ""
+        return self._query(f"""
+            WITH runs AS (
+                SELECT COALESCE(monitored_product, product_name) AS product, pharmacy,
+                       MAX(timestamp, ?) AS started,
+                       MAX(COALESCE(last_seen, timestamp)) AS seen_until,
+                       MIN(total_effective_price) AS price
+                FROM price_history
+                WHERE COALESCE(last_seen, timestamp) >= ? {product_filter}
+                GROUP BY product, pharmacy, timestamp
+            ),
+            timed AS (
+                SELECT *,
+                       julianday(COALESCE(LEAD(started) OVER w, seen_until)) - julianday(started) AS weight,
+                       LAG(price) OVER w AS previous
+                FROM runs
+                WINDOW w AS (PARTITION BY product, pharmacy ORDER BY started)
+            ),
+            ranked AS (
+                SELECT *,
+                       SUM(weight) OVER (
+                           PARTITION BY product, pharmacy ORDER BY price, started ROWS UNBOUNDED PRECEDING
+                       ) AS cumulative_weight,
+                       SUM(weight) OVER (PARTITION BY product, pharmacy) AS total_weight,
+                       ROW_NUMBER() OVER (PARTITION BY product, pharmacy ORDER BY seen_until DESC, price) AS recency,
+                       MIN(price) OVER (
+                           PARTITION BY product, pharmacy ORDER BY julianday(seen_until)
+                           RANGE BETWEEN 7 PRECEDING AND CURRENT ROW
+                       ) AS rolling_min_7d
+                FROM timed
+            )
+            SELECT product, pharmacy,
+                   ROUND(MAX(total_weight), 2) AS days_observed,
+                   MAX(CASE WHEN recency = 1 THEN price END) AS current_price,
+                   MIN(price) AS min_price,
+                   MIN(CASE WHEN cumulative_weight >= total_weight * 0.5 - 1e-9 THEN price END) AS median_price,
+                   MIN(CASE WHEN cumulative_weight >= total_weight * ? - 1e-9 THEN price END) AS percentile_price,
+                   MAX(CASE WHEN recency = 1 THEN rolling_min_7d END) AS rolling_min_7d,
+                   SUM(CASE WHEN previous IS NOT NULL AND price < previous - 0.005 THEN 1 ELSE 0 END) AS price_drops,
+                   ROUND(7.0 * SUM(CASE WHEN previous IS NOT NULL AND price < previous - 0.005 THEN 1 ELSE 0 END)
+                         / NULLIF(MAX(total_weight), 0), 2) AS drops_per_week
+            FROM ranked
+            GROUP BY product, pharmacy
+            ORDER BY product, min_price
+        """, (since, since, product, percentile) if product else (since, since, percentile))
+
+    def best_ever(self, product=None):
+        """Menor preço de todo o histórico por produto e farmácia, quando foi visto e há quantos dias."""
+        # No SQLite, colunas soltas junto de MIN() vêm da própria linha do mínimo
+        rows = self._query(f"""
+            SELECT COALESCE(monitored_product, product_name) AS product, pharmacy,
+                   MIN(total_effective_price) AS best_price,
+                   COALESCE(last_seen, timestamp) AS best_seen_at
+            FROM price_history
+            {"WHERE COALESCE(monitored_product, product_name) = ?" if product else ""}
+            GROUP BY product, pharmacy
+            ORDER BY product, best_price
+        """, (product,) if product else ())
+        now = datetime.now()
+        for row in rows:
+            seen_at = _parse_timestamp(row["best_seen_at"])
+            row["days_since_best"] = round((now - seen_at).total_seconds() / 86400, 1) if seen_at else None
+        return rows
+
+    def best_pharmacy(self, days=30, product=None):
+        """
+        Farmácia vencedora de cada produto no período: a que ficou mais tempo com a melhor
+        oferta (is_best_offer, até a melhor oferta seguinte ou até ser vista pela última vez),
+        com o menor preço visto como desempate.
+        """
+        since = datetime.now() - timedelta(days=days)
+        product_filter = "AND COALESCE(monitored_product, product_name) = ?" if product else ""
+        params = (since, since, product) if product else (since, since)
+        return self._query(f"""
+            WITH best AS (
+                SELECT COALESCE(monitored_product, product_name) AS product, pharmacy,
+                       MAX(timestamp, ?) AS started, COALESCE(last_seen, timestamp) AS seen_until
+                FROM price_history
+                WHERE is_best_offer AND COALESCE(last_seen, timestamp) >= ? {product_filter}
+            ),
+            wins AS (
+                SELECT product, pharmacy,
+                       SUM(julianday(COALESCE(next_started, seen_until)) - julianday(started)) AS days_best
+                FROM (SELECT *, LEAD(started) OVER (PARTITION BY product ORDER BY started) AS next_started FROM best)
+                GROUP BY product, pharmacy
+            ),
+            prices AS (
+                SELECT COALESCE(monitored_product, product_name) AS product, pharmacy,
+                       MIN(total_effective_price) AS min_price
+                FROM price_history
+                WHERE COALESCE(last_seen, timestamp) >= ? {product_filter}
+                GROUP BY product, pharmacy
+            ),
+            ranked AS (
+                SELECT prices.product, prices.pharmacy, prices.min_price,
+                       COALESCE(wins.days_best, 0) AS days_best,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY prices.product ORDER BY COALESCE(wins.days_best, 0) DESC, prices.min_price
+                       ) AS rn,
+                       SUM(COALESCE(wins.days_best, 0)) OVER (PARTITION BY prices.product) AS total_days
+                FROM prices LEFT JOIN wins USING (product, pharmacy)
+            )
+            SELECT product, pharmacy AS best_pharmacy, ROUND(days_best, 2) AS days_best,
+                   ROUND(days_best / NULLIF(total_days, 0), 3) AS best_share, min_price
+            FROM ranked WHERE rn = 1
+            ORDER BY product
+        """, params + params[1:])
+
+    def build(self, days=30, percentile=0.9, product=None):
+        return {
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "days": days,
+            "percentile": percentile,
+            "price_stats": self.price_stats(days, percentile, product),
+            "best_ever": self.best_ever(product),
+            "best_pharmacy": self.best_pharmacy(days, product),
+        }
+
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def format_table(rows, columns):
+    """Tabela de texto simples para o terminal."""
+    if not rows:
+        return "  (sem dados no período)"
+    cells = [[_format_cell(row.get(column)) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(line[i]) for line in cells)) for i, column in enumerate(columns)]
+    lines = ["  " + "  ".join(column.ljust(width) for column, width in zip(columns, widths))]
+    for line in cells:
+        lines.append("  " + "  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+    return "\n".join(lines)
+
+
+def _format_cell(value):
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return "" if value is None else str(value)
+
+
+def to_csv(rows):
+    if not rows:
+        return ""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=list(rows[0].keys()))
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def print_report(report):
+    pct = int(report["percentile"] * 100)
+    print(f"Estatísticas de preço efetivo (últimos {report['days']} dias, p{pct}):")
+    print(format_table(report["price_stats"], [
+        "product", "pharmacy", "days_observed", "current_price", "min_price", "median_price",
+        "percentile_price", "rolling_min_7d", "price_drops", "drops_per_week",
+    ]))
+    print("\nMelhor preço de todo o histórico:")
+    print(format_table(report["best_ever"], ["product", "pharmacy", "best_price", "best_seen_at", "days_since_best"]))
+    print(f"\nFarmácia vencedora (últimos {report['days']} dias):")
+    print(format_table(report["best_pharmacy"], ["product", "best_pharmacy", "days_best", "best_share", "min_price"]))
+
+
+def export_report(report, path):
+    """Exporta em JSON (relatório completo) ou CSV (apenas as estatísticas de preço), pela extensão."""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            f.write(to_csv(report["price_stats"]))
+        else:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
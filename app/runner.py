@@ -0,0 +1,125 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from app.titles import filter_for
+
+
+class StageTimer:
+    """Acumula o tempo de parede (wall-clock) gasto em cada etapa da execução."""
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def track(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.totals[stage] = self.totals.get(stage, 0.0) + elapsed
+                self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def report(self):
+        total = time.perf_counter() - self._started
+        print("\nTempo por etapa:")
+        for stage in sorted(self.totals, key=self.totals.get, reverse=True):
+            print(f"  {stage}: {self.totals[stage]:.2f}s ({self.counts[stage]}x)")
+        print(f"  Total (wall-clock): {total:.2f}s")
+
+
+class SearchPlan:
+    """
+    Agrupa os produtos por (farmácia, termo de busca, CEP), para que cada busca
+    seja feita uma única vez por execução e o resultado seja repartido entre
+    todos os produtos que compartilham o mesmo termo.
+    """
+
+    def __init__(self, products, scrapers, cep):
+        self.products = products
+        self.scrapers = scrapers
+        self.cep = cep
+        # chave -> (scraper, termo, cep), na ordem em que aparecem no config
+        self.searches = {}
+        # chave -> produtos que compartilham a busca (para o filtro de títulos)
+        self.products_by_key = {}
+        for product in products:
+            for scraper in scrapers:
+                key = self.key(scraper, product)
+                if key not in self.searches:
+                    self.searches[key] = (scraper, product["search_term"], self.cep_for(product))
+                self.products_by_key.setdefault(key, []).append(product)
+
+    def cep_for(self, product):
+        return product.get("cep", self.cep)
+
+    def key(self, scraper, product):
+        return (scraper.pharmacy, product["search_term"], self.cep_for(product))
+
+    def keys_for(self, product):
+        """Chaves das buscas de um produto, na ordem dos scrapers."""
+        return [self.key(scraper, product) for scraper in self.scrapers]
+
+    def accept_for(self, key):
+        """
+        Filtro de títulos aplicado dentro da busca, antes do frete e das PDPs: aceita o
+        título se algum produto que compartilha a busca o aceitaria. None = aceita tudo.
+        """
+        filters = [filter_for(product) for product in self.products_by_key[key]]
+        if any(not title_filter.terms for title_filter in filters):
+            return None
+        return lambda title: any(title_filter.matches(title) for title_filter in filters)
+
+    def summary(self):
+        total = len(self.products) * len(self.scrapers)
+        return f"{len(self.searches)} buscas distintas para {total} combinações produto × farmácia"
+
+
+class ConcurrentRunner:
+    """
+    Executa as buscas distintas de um SearchPlan em todas as farmácias ao mesmo tempo.
+    Cada host tem um limite próprio de buscas simultâneas; as ofertas vão para o
+    OfferPipeline enquanto chegam e cada produto é entregue assim que suas buscas terminam.
+    """
+
+    def __init__(self, scrapers, max_workers=6, host_concurrency=2, timer=None):
+        self.scrapers = scrapers
+        self.max_workers = max_workers
+        self.timer = timer or StageTimer()
+        self.host_slots = {}
+        for scraper in scrapers:
+            if scraper.host not in self.host_slots:
+                self.host_slots[scraper.host] = threading.BoundedSemaphore(host_concurrency)
+
+    def _run_search(self, fetch, pipeline, key, scraper, term, cep, accept, stage):
+        # A busca é um gerador: é consumida aqui dentro, ocupando a vaga do host até o fim
+        with self.host_slots[scraper.host]:
+            with self.timer.track(stage):
+                pipeline.feed(key, fetch(scraper, term, cep, accept))
+
+    def run(self, plan, fetch, pipeline):
+        """
+        Gera os ProductStream do `pipeline` na ordem em que ficam prontos.
+        `fetch(scraper, termo, cep, accept)` gera as ofertas de cada busca distinta do plano,
+        executada uma única vez.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            for key, (scraper, term, cep) in plan.searches.items():
+                stage = f"busca {scraper.pharmacy}"
+                future = executor.submit(
+                    self._run_search, fetch, pipeline, key, scraper, term, cep, plan.accept_for(key), stage
+                )
+                futures[future] = key
+
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"    Erro na busca {futures[future]}: {e}")
+                yield from pipeline.complete(futures[future])
@@ -0,0 +1,83 @@
+import re
+import time
+
+INTERVAL_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$', re.IGNORECASE)
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "": 60}
+
+
+def parse_interval(value, default):
+    """
+    Converte o `check_every` do config.json em segundos.
+    Aceita número (minutos) ou texto como "30m", "6h", "1d".
+    """
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float(value) * 60
+    match = INTERVAL_PATTERN.match(str(value))
+    if not match:
+        print(f"  Aviso: check_every inválido ({value!r}). Use minutos ou algo como \"6h\".")
+        return default
+    return float(match.group(1)) * INTERVAL_UNITS[match.group(2).lower()]
+
+
+class ProductScheduler:
+    """
+    Agenda cada produto no seu próprio intervalo (`check_every`) para o modo daemon.
+    Produtos cuja última melhor oferta ficou perto do preço alvo são verificados com
+    mais frequência e passam na frente quando vários vencem ao mesmo tempo.
+    """
+
+    def __init__(self, default_interval, near_threshold=0.1, near_factor=0.5):
+        self.default_interval = default_interval
+        self.near_threshold = near_threshold
+        self.near_factor = near_factor
+        self.products = []
+        self.next_due = {}
+        self.last_best = {}
+
+    def key(self, product):
+        return (product["name"], product["search_term"])
+
+    def load(self, products):
+        """(Re)carrega os produtos do config, mantendo o agendamento dos que já existiam."""
+        now = time.monotonic()
+        self.products = list(products)
+        keys = {self.key(product) for product in self.products}
+        self.next_due = {key: due for key, due in self.next_due.items() if key in keys}
+        self.last_best = {key: price for key, price in self.last_best.items() if key in keys}
+        for product in self.products:
+            self.next_due.setdefault(self.key(product), now)
+
+    def proximity(self, product):
+        """Razão entre a última melhor oferta e o alvo (1.0 = no alvo); sem histórico vem por último."""
+        last = self.last_best.get(self.key(product))
+        if last is None or not product.get("threshold_price"):
+            return float("inf")
+        return last / product["threshold_price"]
+
+    def interval_for(self, product):
+        interval = parse_interval(product.get("check_every"), self.default_interval)
+        if self.proximity(product) <= 1 + self.near_threshold:
+            interval *= self.near_factor
+        return interval
+
+    def due(self):
+        """Produtos cujo horário chegou, os mais próximos do alvo primeiro."""
+        now = time.monotonic()
+        due = [product for product in self.products if self.next_due[self.key(product)] <= now]
+        return sorted(due, key=self.proximity)
+
+    def record(self, products, best_prices):
+        """Registra a verificação e agenda a próxima; `best_prices` é {nome: preço total da melhor oferta}."""
+        now = time.monotonic()
+        for product in products:
+            key = self.key(product)
+            if best_prices.get(product["name"]) is not None:
+                self.last_best[key] = best_prices[product["name"]]
+            self.next_due[key] = now + self.interval_for(product)
+
+    def seconds_until_next(self, max_wait):
+        if not self.next_due:
+            return max_wait
+        return max(0.0, min(max_wait, min(self.next_due.values()) - time.monotonic()))
@@ -1,128 +1,255 @@
-from scrapling import Fetcher
 import json
-import re
-import httpx
-from selectolax.parser import HTMLParser
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from app.breaker import CircuitBreaker, CircuitOpenError
+from app.cache import TTLCache
+from app.cart import cart_key, cart_options, cart_quantities, promotion_tiers, quoted_shipping, split_cart_key
+from app.jsonindex import JsonIndex, first_script, loads, script_contents
+from app.metrics import metrics, timed
+from app.ratelimit import RateLimiter
+from app.sessions import SessionPool
+from app.titles import parse_price, parse_quantity
 
 class BaseScraper:
-    def __init__(self):
+    host = None
+    pharmacy = None
+    # Máximo de SKUs por requisição de simulação de frete VTEX
+    VTEX_SIMULATION_CHUNK = 50
+    # Busca paginada: produtos por página e limite de páginas por termo
+    SEARCH_PAGE_SIZE = 24
+    SEARCH_MAX_PAGES = 5
+
+    def __init__(self, shipping_cache=None, rate_limiter=None, session_pool=None, circuit_breaker=None):
+        self.shipping_cache = shipping_cache
+        # Todas as requisições passam pelo limitador do host (token bucket adaptativo)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # ...e pelo circuit breaker do host, que recusa na hora as de sites fora do ar ou bloqueando
+        self.circuit_breaker = circuit_breaker or CircuitBreaker.disabled()
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
             "Accept-Language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
         }
-        # Fetcher uses curl-cffi for stealth without needing Playwright binary
-        self.fetcher = Fetcher()
+        # Sessões persistentes por host (curl-cffi via Scrapling + httpx no fallback),
+        # reaproveitando conexões entre buscas, PDPs e fretes
+        self.sessions = session_pool or SessionPool(headers=self.headers)
+
+    def _retry_after(self, headers):
+        try:
+            return float((headers or {}).get("retry-after") or (headers or {}).get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    def http_get(self, url, **kwargs):
+        """GET via Scrapling Fetcher, respeitando o limite de requisições e o circuit breaker do host."""
+        return self._request("get", url, **kwargs)
+
+    def http_post(self, url, **kwargs):
+        """POST via Scrapling Fetcher, respeitando o limite de requisições e o circuit breaker do host."""
+        return self._request("post", url, **kwargs)
+
+    def _request(self, method, url, record_outcome=True, **kwargs):
+        # Com o circuito aberto, levanta CircuitOpenError sem esperar o limitador nem ir à rede.
+        # Com record_outcome=False quem chama registra no breaker o resultado final (ex: após o fallback)
+        self.circuit_breaker.check(url)
+        self.rate_limiter.acquire(url)
+        try:
+            with metrics.track(f"http_{method}", self.pharmacy) as sample:
+                response = getattr(self.sessions.stealth(url), method)(url, **kwargs)
+                sample["nbytes"] = len(getattr(response, "body", None) or b"")
+                sample["error"] = response.status >= 400
+        except Exception as e:
+            if record_outcome:
+                self.circuit_breaker.record(url, error=e)
+            raise
+        self.rate_limiter.record(url, response.status, self._retry_after(getattr(response, "headers", None)))
+        if record_outcome:
+            self.circuit_breaker.record(url, response.status)
+        return response
 
     def fetch_page(self, url):
+        body = self.fetch_body(url)
+        return body.decode('utf-8', 'ignore') if body is not None else None
+
+    def fetch_body(self, url):
+        """Como fetch_page, mas devolve os bytes crus da resposta (sem decodificar)."""
+        with metrics.track("fetch_page", self.pharmacy) as sample:
+            body = self._fetch_body(url)
+            sample["nbytes"] = len(body) if body else 0
+            sample["error"] = body is None
+        return body
+
+    def _fetch_body(self, url):
+        # A tentativa do Scrapling e o fallback httpx são uma única busca para o circuit
+        # breaker: só o resultado final conta como sucesso ou falha do host
         try:
             # Scrapling Fetcher automatically handles headers and anti-bot measures via curl-cffi
-            response = self.fetcher.get(url)
+            response = self._request("get", url, record_outcome=False)
             if response.status == 200:
-                return response.body.decode('utf-8', 'ignore') if hasattr(response, 'body') else ""
+                self.circuit_breaker.record(url, response.status)
+                return (response.body or b"") if hasattr(response, 'body') else b""
             else:
                 print(f"Erro ao acessar {url}: Status {response.status}")
                 # Tentamos um fallback com httpx se o SteathFetcher falhar por algum motivo
-                with httpx.Client(headers=self.headers, follow_redirects=True, timeout=15.0) as client:
-                    resp = client.get(url)
-                    if resp.status_code == 200:
-                        return resp.text
+                self.rate_limiter.acquire(url)
+                with metrics.track("http_fallback", self.pharmacy) as sample:
+                    resp = self.sessions.client(url).get(url, headers=self.headers)
+                    sample["nbytes"] = len(resp.content or b"")
+                    sample["error"] = resp.status_code >= 400
+                self.rate_limiter.record(url, resp.status_code, self._retry_after(resp.headers))
+                self.circuit_breaker.record(url, resp.status_code)
+                if resp.status_code == 200:
+                    return resp.content
                 return None
+        except CircuitOpenError:
+            return None
         except Exception as e:
+            self.circuit_breaker.record(url, error=e)
             print(f"Erro ao acessar {url}: {e}")
             return None
 
+    def search_pages(self, page_url, parse_page, limit=None):
+        """
+        Percorre uma busca paginada gerando as ofertas de cada página assim que ela chega.
+        `page_url(página)` monta a URL (páginas a partir de 1) e `parse_page(dados)` devolve
+        (ofertas, produtos na página). Para quando uma página não traz nenhuma oferta,
+        quando vem incompleta (última página) ou quando `limit` ofertas já foram geradas.
+        """
+        found = 0
+        for page in range(1, self.SEARCH_MAX_PAGES + 1):
+            resp = self.http_get(page_url(page))
+            if resp.status not in [200, 206]:
+                break
+            offers, page_size = parse_page(loads(resp.body))
+            yield from offers
+            found += len(offers)
+            if not offers or page_size < self.SEARCH_PAGE_SIZE or (limit and found >= limit):
+                break
+
     def parse_price(self, price_str):
-        if not price_str: return 0.0
-        # Remove R$, dots, and replace comma with dot
-        clean = re.sub(r'[^\d,]', '', price_str).replace(',', '.')
-        try:
-            return float(clean) if clean else 0.0
-        except:
-            return 0.0
+        return parse_price(price_str)
 
     def parse_quantity(self, title):
-        if not title: return 1
-        # Procura padrões como "30 comprimidos", "28 drágeas", "60 caps"
-        match = re.search(r'(\d+)\s*(comprimidos|caps|drag|unid|comp|drágeas|cápsulas)', title, re.IGNORECASE)
-        if match:
-            return int(match.group(1))
-        # Fallback: procurar qualquer número isolado que pareça uma contagem comum
-        match = re.search(r'\b(20|21|28|30|42|56|60|84|90)\b', title)
-        return int(match.group(1)) if match else 1
-
-    def calculate_best_unit_price(self, base_price, teasers, available_qty):
+        # Padrões pré-compilados e cache LRU por título (ver app/titles.py)
+        return parse_quantity(title)
+
+    def cached_shipping_costs(self, skus, cep, fetch):
         """
-        Calcula o melhor preço unitário considerando promoções progressivas (ex: Leve 3 Pague 2).
-        Retorna (preço_unitário_calculado, info_promoção)
+        Consulta o cache de frete antes de ir para a rede.
+        `fetch(skus)` deve cotar apenas os SKUs que faltam e retornar {sku: frete};
+        SKUs que falharam não devem aparecer no retorno, para não irem para o cache.
+        """
+        skus = [str(sku) for sku in skus]
+        if self.shipping_cache is None or not cep:
+            return fetch(skus)
+        cep_clean = cep.replace("-", "")
+        cached, missing = self.shipping_cache.get_many(self.pharmacy, skus, cep_clean)
+        if missing:
+            quotes = fetch(missing)
+            self.shipping_cache.put_many(self.pharmacy, cep_clean, quotes)
+            cached.update(quotes)
+        return cached
+
+    def simulate_vtex_shipping(self, url, skus, cep, label, separate_carts=False):
         """
-        best_price = float(base_price)
-        promo_info = ""
+        Simula o frete VTEX de vários SKUs de uma vez (orderForms/simulation).
+        Cada item pode ser um SKU (1 caixa) ou uma chave de cart_key (SKU e nº de caixas).
+        Retorna {item: menor_frete_de_entrega}; itens sem entrega ficam com 0.0 e itens com
+        erro ficam fora do retorno.
 
-        if not teasers:
-            return best_price, promo_info
+        Num carrinho com vários itens, o frete de cada um é a sua parte do frete do carrinho
+        e o frete grátis é avaliado sobre o subtotal de todos. Com `separate_carts`, cada
+        item é simulado sozinho, como se fosse o carrinho inteiro (uma requisição por item).
+        """
+        costs = {}
+        if not cep or not skus: return costs
+        cep_clean = cep.replace("-", "")
+        headers = self.headers.copy()
+        headers["Content-Type"] = "application/json"
+        # Define o cookie de CEP para tentar "forçar" o contexto regional na VTEX
+        headers["Cookie"] = f"vtex_postalCode={cep_clean};"
 
-        for teaser in teasers:
+        unique_skus = list(dict.fromkeys(str(sku) for sku in skus))
+        chunk_size = 1 if separate_carts else self.VTEX_SIMULATION_CHUNK
+        for start in range(0, len(unique_skus), chunk_size):
+            chunk = unique_skus[start:start + chunk_size]
+            payload = {
+                "items": [{"id": sku, "quantity": boxes, "seller": "1"} for sku, boxes in map(split_cart_key, chunk)],
+                "country": "BRA",
+                "postalCode": cep_clean,
+                "shippingData": {
+                    "address": {
+                        "postalCode": cep_clean,
+                        "country": "BRA"
+                    }
+                }
+            }
             try:
-                conditions = teaser.get("conditions", {})
-                min_qty = int(conditions.get("minimumQuantity", 1))
-                
-                # Só aplica se houver estoque suficiente para a promoção
-                if min_qty > 1 and available_qty >= min_qty:
-                    effects = teaser.get("effects", {})
-                    params = effects.get("parameters", [])
-                    
-                    discount_pct = 0
-                    for p in params:
-                        if p.get("name") == "PercentualDiscount":
-                            discount_pct = float(p.get("value", 0))
-                    
-                    if discount_pct > 0:
-                        # Lógica VTEX comum: "Leve X, o último sai com Y% de desconto"
-                        # Para "Leve 3 Pague 2", o desconto é 100% em 1 item a cada 3.
-                        total_cost = (base_price * (min_qty - (discount_pct / 100.0)))
-                        promo_unit_price = total_cost / min_qty
-                        
-                        if promo_unit_price < best_price:
-                            best_price = promo_unit_price
-                            promo_info = f"Leve {min_qty} Pague {(min_qty - (discount_pct/100.0)):.0f}"
-                            if discount_pct < 100:
-                                promo_info = f"Leve {min_qty} com {discount_pct}% no último"
+                resp = self.http_post(url, data=json.dumps(payload), headers=headers)
+                if resp.status in [200, 206]:
+                    data = loads(resp.body)
+                    logistics = data.get("shippingData", {}).get("logisticsInfo", [])
+                    for position, info in enumerate(logistics):
+                        # itemIndex aponta para a posição do item no payload enviado
+                        index = info.get("itemIndex", position)
+                        if not isinstance(index, int) or not 0 <= index < len(chunk):
+                            continue
+                        # FILTRO: Ignorar "Retire na Loja" (deliveryChannel != 'delivery')
+                        delivery_slas = [s for s in info.get("slas", []) if s.get("deliveryChannel") == "delivery"]
+                        prices = [float(s.get("price", 99999)) / 100.0 for s in delivery_slas]
+                        # Se só houver retirada, o frete de entrega não está disponível
+                        costs[chunk[index]] = min(prices) if prices else 0.0
             except Exception as e:
-                print(f"    Erro ao processar teaser: {e}")
-                continue
-                
-        return best_price, promo_info
+                print(f"    Erro ao calcular frete {label}: {e}")
+        return costs
 
 class DrogasilScraper(BaseScraper):
-    def search_medication(self, term, cep=None):
+    host = "www.drogasil.com.br"
+    pharmacy = "Drogasil"
+
+    def __init__(self, shipping_cache=None, rate_limiter=None, session_pool=None, circuit_breaker=None, pdp_workers=4, pdp_cache_ttl=900, cart_max_boxes=1):
+        super().__init__(shipping_cache=shipping_cache, rate_limiter=rate_limiter, session_pool=session_pool, circuit_breaker=circuit_breaker)
+        # Páginas de produto (PDP) são consultadas em paralelo e guardadas por URL durante a execução
+        self.pdp_workers = pdp_workers
+        self.pdp_cache = TTLCache(ttl_seconds=pdp_cache_ttl)
+        # Otimizador de carrinho: o frete é cotado de 1 até cart_max_boxes caixas, como nas lojas VTEX
+        self.cart_max_boxes = cart_max_boxes
+
+    @timed("search_medication")
+    def search_medication(self, term, cep=None, accept=None, limit=None):
+        """
+        Gera as ofertas à medida que o preço da PDP e o frete de cada uma chegam.
+        `accept(título)` descarta produtos antes das consultas de PDP e frete.
+        A busca da Drogasil vem em uma única página, então `limit` não se aplica.
+        """
         base_url = "https://www.drogasil.com.br"
         url = f"{base_url}/search?w={term}"
         print(f"    Buscando Drogasil via Scrapling: {url}")
-        html = self.fetch_page(url)
-        if not html: return []
-        parser = HTMLParser(html)
-        next_data_script = parser.css_first("script#__NEXT_DATA__")
-        results = []
-        
-        if next_data_script:
+        body = self.fetch_body(url)
+        if not body: return
+        # O JSON do __NEXT_DATA__ é lido direto dos bytes; o DOM só é montado no fallback CSS
+        next_data_script = first_script(body, b"__NEXT_DATA__")
+        found = 0
+
+        if next_data_script is not None:
             try:
-                data = json.loads(next_data_script.text())
-                def find_products(obj):
-                    if isinstance(obj, dict):
-                        if "products" in obj and isinstance(obj["products"], list):
-                            return obj["products"]
-                        for v in obj.values():
-                            res = find_products(v)
-                            if res: return res
-                    elif isinstance(obj, list):
-                        for item in obj:
-                            res = find_products(item)
-                            if res: return res
-                    return None
-                
-                raw_products = find_products(data) or []
+                data = loads(next_data_script)
+                # Um único percurso do __NEXT_DATA__ para achar a lista de produtos
+                index = JsonIndex(data, keys=("products",))
+                raw_products = index.first("products", lambda v: isinstance(v, list)) or []
+                if accept:
+                    raw_products = [prod for prod in raw_products if accept(prod.get("name") or "")]
+                links = []
                 for prod in raw_products:
+                    link = base_url + "/" + prod.get("url_key", prod.get("url", ""))
+                    if not link.startswith("http"): link = base_url + link
+                    links.append(link)
+
+                # Fix: Busca o preço real na página do produto (PDP), em paralelo
+                pdp_prices = self.iter_pdp_prices(links)
+
+                for prod, link, real_price in zip(raw_products, links, pdp_prices):
                     title = prod.get("name")
                     # Tenta várias possibilidades de preço no JSON da Drogasil
                     price = prod.get("price", {}).get("value")
@@ -132,21 +259,16 @@ class DrogasilScraper(BaseScraper):
                         price = prod.get("priceService")
                     if not price:
                         price = prod.get("valueTo", 0)
-                    
-                    link = base_url + "/" + prod.get("url_key", prod.get("url", ""))
-                    if not link.startswith("http"): link = base_url + link
-                    
-                    # Fix: Busca o preço real na página do produto (PDP)
-                    real_price = self.fetch_pdp_price(link)
+
                     if real_price > 0:
                         price = real_price
-                    
+
                     qty = self.parse_quantity(title)
                     # Detecta promoções (Leve Mais Pague Menos)
                     price_aux = prod.get("price_aux", {})
                     lmpm_price = price_aux.get("lmpm_value_to")
                     lmpm_qty = price_aux.get("lmpm_qty")
-                    
+
                     display_title = title
                     if lmpm_price and lmpm_qty:
                         # Se o preço promocional for menor, usamos ele
@@ -155,81 +277,113 @@ class DrogasilScraper(BaseScraper):
                             display_title += f" (Leve {lmpm_qty} Pague Menos: R$ {lmpm_price} cada)"
 
                     sku = prod.get("sku", prod.get("objectID"))
-                    shipping_cost = self.fetch_shipping_cost(sku, cep)
-                    
-                    results.append({
+                    # O estoque não vem na busca: cota todas as quantidades; as que a API
+                    # recusar ficam fora das opções
+                    boxes = cart_quantities(self.cart_max_boxes, self.cart_max_boxes)
+                    shipping_costs = self.fetch_shipping_costs([cart_key(sku, n) for n in boxes], cep) if sku else {}
+                    shipping_cost = shipping_costs.get(cart_key(sku, 1), 0.0) if sku else 0.0
+
+                    found += 1
+                    yield {
                         "pharmacy": "Drogasil",
                         "title": display_title,
                         "price": float(price),
                         "quantity": qty,
                         "unit_price": float(price) / qty if qty > 0 else float(price),
                         "url": link,
-                        "shipping": shipping_cost
-                    })
+                        "shipping": shipping_cost,
+                        "cart": cart_options(float(price), (), quoted_shipping(shipping_costs, sku, boxes, shipping_cost))
+                    }
             except Exception as e:
                 print(f"    Erro no parse JSON Drogasil: {e}")
-        
+
         # Fallback CSS se JSON vier vazio
-        if not results:
+        if not found:
+            # selectolax só é carregado quando o fallback CSS é necessário
+            from selectolax.parser import HTMLParser
             # Classes da Drogasil costumam mudar, mas o h2 costuma ser o título
+            parser = HTMLParser(body.decode('utf-8', 'ignore'))
             cards = parser.css("div[class*='ProductCard']")
+            candidates = []
             for card in cards:
                 title_elem = card.css_first("h2")
                 price_elem = card.css_first("span[class*='Price']")
                 link_elem = card.css_first("a")
                 if title_elem and price_elem:
                     title = title_elem.text(strip=True)
-                    price = self.parse_price(price_elem.text())
+                    if accept and not accept(title):
+                        continue
                     link = base_url + link_elem.attributes.get("href", "")
-                    qty = self.parse_quantity(title)
-                    # Fallback também deve ser validado no PDP ou checar texto
-                    real_pdp_price = self.fetch_pdp_price(link)
-                    if real_pdp_price > 0:
-                        results.append({
-                            "pharmacy": "Drogasil",
-                            "title": title,
-                            "price": real_pdp_price,
-                            "quantity": qty,
-                            "unit_price": real_pdp_price / qty if qty > 0 else real_pdp_price,
-                            "url": link,
-                            "shipping": 0.0 # Shipping check here might be too heavy for fallback
-                        })
-        return results
+                    candidates.append((title, link))
+
+            # Fallback também deve ser validado no PDP ou checar texto
+            pdp_prices = self.iter_pdp_prices([link for _, link in candidates])
+            for (title, link), real_pdp_price in zip(candidates, pdp_prices):
+                qty = self.parse_quantity(title)
+                if real_pdp_price > 0:
+                    yield {
+                        "pharmacy": "Drogasil",
+                        "title": title,
+                        "price": real_pdp_price,
+                        "quantity": qty,
+                        "unit_price": real_pdp_price / qty if qty > 0 else real_pdp_price,
+                        "url": link,
+                        "shipping": 0.0 # Shipping check here might be too heavy for fallback
+                    }
 
+    def iter_pdp_prices(self, urls):
+        """
+        Busca os preços de várias PDPs em paralelo, gerando um preço por URL (na ordem de
+        `urls`) assim que ele chega, para que a oferta siga sem esperar as demais PDPs.
+        """
+        unique_urls = list(dict.fromkeys(urls))
+        if not unique_urls: return
+        workers = max(1, min(self.pdp_workers, len(unique_urls)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {url: executor.submit(self.fetch_pdp_price, url) for url in unique_urls}
+            try:
+                for url in urls:
+                    yield futures[url].result()
+            finally:
+                # Consumo interrompido: as PDPs que ainda nem começaram são descartadas
+                for future in futures.values():
+                    future.cancel()
+
+    @timed("fetch_pdp_price")
     def fetch_pdp_price(self, url):
         """Busca o preço com desconto (value_to) na página de detalhes do produto."""
+        cached = self.pdp_cache.get(url)
+        if cached is not None:
+            return cached
+        price = self._parse_pdp_price(url)
+        # Falhas de rede (None) não vão para o cache
+        if price is None:
+            return 0.0
+        self.pdp_cache.set(url, price)
+        return price
+
+    def _parse_pdp_price(self, url):
         try:
-            html = self.fetch_page(url)
-            if not html: return 0.0
+            body = self.fetch_body(url)
+            if not body: return None
             
-            parser = HTMLParser(html)
-            next_data_script = parser.css_first("script#__NEXT_DATA__")
-            if next_data_script:
-                data = json.loads(next_data_script.text())
-                
-                def find_field(obj, field_name):
-                    if isinstance(obj, dict):
-                        if field_name in obj: return obj[field_name]
-                        for v in obj.values():
-                            res = find_field(v, field_name)
-                            if res: return res
-                    elif isinstance(obj, list):
-                        for item in obj:
-                            res = find_field(item, field_name)
-                            if res: return res
-                    return None
+            next_data_script = first_script(body, b"__NEXT_DATA__")
+            if next_data_script is not None:
+                data = loads(next_data_script)
+                # Indexa todos os campos usados abaixo em um único percurso do JSON
+                index = JsonIndex(data, keys=("value_to", "status", "price_aux", "priceService"))
 
                 # Tenta value_to (preço final com desconto)
                 # Se estiver esgotado, value_to costuma ser None ou 0
-                value_to = find_field(data, "value_to")
+                value_to = index.first("value_to")
                 
                 # Verifica se há indicador de estoque
-                stock_status = find_field(data, "status") # IN_STOCK ou similar
+                stock_status = index.first("status") # IN_STOCK ou similar
                 if stock_status and stock_status != "IN_STOCK" and stock_status != 1:
                     return 0.0
 
                 # Tenta lmpm (Leve Mais Pague Menos)
-                price_aux = find_field(data, "price_aux")
+                price_aux = index.first("price_aux")
                 if price_aux:
                     lmpm_price = price_aux.get("lmpm_value_to")
                     if lmpm_price: return float(lmpm_price)
@@ -237,298 +391,296 @@ class DrogasilScraper(BaseScraper):
                 if value_to: return float(value_to)
                 
                 # Fallback: priceService se estiver no PDP (as vezes tem)
-                ps = find_field(data, "priceService")
+                ps = index.first("priceService")
                 if ps: return float(ps)
                 
             # Verifica visualmente se está esgotado no HTML
-            if "Produto Indisponível" in html or "Avise-me" in html:
+            if "Produto Indisponível".encode() in body or b"Avise-me" in body:
                 return 0.0
                 
             return 0.0
         except:
-            return 0.0
+            return None
+
+    @timed("fetch_shipping_cost")
+    def fetch_shipping_costs(self, skus, cep):
+        """
+        Busca o frete na API da Drogasil (consultando antes o cache de frete). Cada item pode
+        ser um SKU (1 caixa) ou uma chave de cart_key (SKU e nº de caixas). Retorna {item: frete}.
+        """
+        if not cep or not skus: return {}
+        return self.cached_shipping_costs(skus, cep, lambda missing: self._calculate_shipping(missing, cep))
 
     def fetch_shipping_cost(self, sku, cep):
-        """Busca o frete na API da Drogasil."""
+        """Frete de uma caixa de um único SKU."""
         if not cep or not sku: return 0.0
+        return self.fetch_shipping_costs([sku], cep).get(str(sku), 0.0)
+
+    def _calculate_shipping(self, skus, cep):
+        """Consulta a API de frete da Drogasil, um carrinho por item. Itens com erro ficam fora do retorno."""
         # Normaliza CEP
         cep_clean = cep.replace("-", "")
         url = "https://www.drogasil.com.br/api/v1/shipping/calculate"
-        payload = {
-            "items": [{"sku": str(sku), "quantity": 1}],
-            "zipCode": cep_clean
-        }
-        try:
-            headers = self.headers.copy()
-            headers["Content-Type"] = "application/json"
-            # Adiciona referer para evitar 503/403 em algumas chamadas de API
-            headers["Referer"] = "https://www.drogasil.com.br/"
-            
-            resp = self.fetcher.post(url, data=json.dumps(payload), headers=headers)
-            if resp.status in [200, 206]:
-                data = json.loads(resp.body)
-                options = data.get("deliveryOptions", [])
-                if options:
+        headers = self.headers.copy()
+        headers["Content-Type"] = "application/json"
+        # Adiciona referer para evitar 503/403 em algumas chamadas de API
+        headers["Referer"] = "https://www.drogasil.com.br/"
+        costs = {}
+        for key in skus:
+            sku, boxes = split_cart_key(key)
+            payload = {
+                "items": [{"sku": sku, "quantity": boxes}],
+                "zipCode": cep_clean
+            }
+            try:
+                resp = self.http_post(url, data=json.dumps(payload), headers=headers)
+                if resp.status in [200, 206]:
+                    data = loads(resp.body)
+                    options = data.get("deliveryOptions", [])
                     prices = [float(opt.get("price", 999)) for opt in options]
-                    return min(prices) if prices else 0.0
-            elif resp.status == 503:
-                # Se der 503, tentamos uma vez mais sem o hífen no CEP (já feito acima) ou com headers mínimos
-                pass
-        except Exception as e:
-            print(f"    Erro ao calcular frete Drogasil: {e}")
-        return 0.0
-
-class PagueMenosScraper(BaseScraper):
-    def search_medication(self, term, cep=None):
-        # Mudando para Intelligent Search para capturar promoções (teasers)
-        api_url = f"https://www.paguemenos.com.br/api/io/_v/api/intelligent-search/product_search/trade-policy/1?query={term}&count=12"
-        print(f"    Buscando Pague Menos via Intelligent Search: {api_url}")
-        
-        results = []
-        try:
-            resp = self.fetcher.get(api_url)
-            if resp.status in [200, 206]:
-                data = json.loads(resp.body)
-                for prod in data.get("products", []):
-                    title = prod.get("productName")
-                    items = prod.get("items", [])
-                    if items:
-                        item = items[0]
-                        sellers = item.get("sellers", [])
-                        if sellers:
-                            offer = sellers[0].get("commertialOffer", {})
-                            available_qty = offer.get("AvailableQuantity", 0)
-                            
-                            if available_qty > 0:
-                                base_price = float(offer.get("Price", 0))
-                                if base_price > 0:
-                                    # Detecta promoções (ex: Leve 3 Pague 2)
-                                    teasers = offer.get("teasers", [])
-                                    price, promo_info = self.calculate_best_unit_price(base_price, teasers, available_qty)
-                                    
-                                    display_title = title
-                                    if promo_info:
-                                        display_title += f" ({promo_info})"
-
-                                    link = "https://www.paguemenos.com.br" + prod.get("link", "")
-                                    qty = self.parse_quantity(title)
-                                    
-                                    shipping_cost = 0.0
-                                    sku = item.get("itemId")
-                                    if cep and sku:
-                                        shipping_cost = self.fetch_shipping_cost(sku, cep)
-                                    
-                                    results.append({
-                                        "pharmacy": "Pague Menos",
-                                        "title": display_title,
-                                        "price": price,
-                                        "quantity": qty,
-                                        "unit_price": price / qty if qty > 0 else price,
-                                        "url": link,
-                                        "shipping": shipping_cost
-                                    })
-        except Exception as e:
-            print(f"    Erro ao consultar API Pague Menos: {e}")
-            
-        # Fallback LEGACY (LD+JSON) se API falhar ou não trouxer nada
-        if not results:
-            # ... mantém a lógica anterior se desejar, mas vou simplificar para carregar do HTML se precisar
-            url = f"https://www.paguemenos.com.br/search?_q={term}"
-            html = self.fetch_page(url)
-            if html:
-                parser = HTMLParser(html)
-                scripts = parser.css("script[type='application/ld+json']")
-                for script in scripts:
-                    try:
-                        data = json.loads(script.text())
-                        if data.get("@type") == "ItemList" and "itemListElement" in data:
-                            for item in data["itemListElement"]:
-                                prod = item.get("item", {})
-                                if prod.get("@type") == "Product":
-                                    offers = prod.get("offers", {})
-                                    availability = offers.get("availability")
-                                    # FILTRO DE ESTOQUE LD+JSON
-                                    if availability == "https://schema.org/InStock":
-                                        title = prod.get("name")
-                                        price = offers.get("lowPrice") or offers.get("price", 0)
-                                        link = prod.get("url")
-                                        qty = self.parse_quantity(title)
-                                        results.append({
-                                            "pharmacy": "Pague Menos",
-                                            "title": title,
-                                            "price": float(price),
-                                            "quantity": qty,
-                                            "unit_price": float(price) / qty if qty > 0 else float(price),
-                                            "url": link,
-                                            "shipping": 0.0
-                                        })
-                    except: continue
-        return results
+                    costs[str(key)] = min(prices) if prices else 0.0
+                elif resp.status == 503:
+                    # Se der 503, tentamos uma vez mais sem o hífen no CEP (já feito acima) ou com headers mínimos
+                    pass
+            except Exception as e:
+                print(f"    Erro ao calcular frete Drogasil: {e}")
+        return costs
 
-    def fetch_shipping_cost(self, sku, cep):
-        """Simulação de frete VTEX para Pague Menos."""
-        if not cep or not sku: return 0.0
-        url = "https://www.paguemenos.com.br/api/checkout/pub/orderForms/simulation"
-        payload = {
-            "items": [{"id": str(sku), "quantity": 1, "seller": "1"}],
-            "country": "BRA",
-            "postalCode": cep.replace("-", ""),
-            "shippingData": {
-                "address": {
-                    "postalCode": cep.replace("-", ""),
-                    "country": "BRA"
-                }
-            }
-        }
+# Loja VTEX: nome da farmácia, URL base, política comercial (trade policy / sales channel),
+# caminho da simulação de frete e fallback quando o Intelligent Search não traz nada
+# ("ld_json", "html" ou None)
+VtexStorefront = namedtuple(
+    "VtexStorefront", ["pharmacy", "base_url", "trade_policy", "simulation_path", "fallback"],
+    defaults=(1, "/api/checkout/pub/orderForms/simulation", None)
+)
+
+PAGUE_MENOS = VtexStorefront("Pague Menos", "https://www.paguemenos.com.br", fallback="ld_json")
+DROGARIA_SAO_PAULO = VtexStorefront(
+    "Drogaria São Paulo", "https://www.drogariasaopaulo.com.br",
+    simulation_path="/api/checkout/pub/orderforms/simulation", fallback="html"
+)
+VTEX_FALLBACKS = (None, "ld_json", "html")
+
+
+def vtex_storefront(entry):
+    """Monta uma VtexStorefront a partir de uma entrada de `vtex_storefronts` do config.json."""
+    if not entry.get("pharmacy") or not entry.get("base_url"):
+        raise ValueError(f"loja VTEX sem pharmacy/base_url: {entry!r}")
+    fallback = entry.get("fallback")
+    if fallback not in VTEX_FALLBACKS:
+        raise ValueError(f"fallback inválido para {entry['pharmacy']}: {fallback!r}")
+    return VtexStorefront(
+        pharmacy=entry["pharmacy"],
+        base_url=entry["base_url"].rstrip("/"),
+        trade_policy=int(entry.get("trade_policy", 1)),
+        simulation_path=entry.get("simulation_path", VtexStorefront._field_defaults["simulation_path"]),
+        fallback=fallback
+    )
+
+
+class VtexScraper(BaseScraper):
+    """
+    Scraper genérico para lojas VTEX: busca paginada no Intelligent Search (com teasers de
+    promoção) e frete em lote pelo orderForms/simulation. Cada farmácia VTEX é apenas uma
+    VtexStorefront; todas compartilham o pool de sessões, o limitador e o cache de frete,
+    e no modo concorrente são buscadas em paralelo como qualquer outro host.
+    """
+
+    def __init__(self, storefront, shipping_cache=None, rate_limiter=None, session_pool=None, circuit_breaker=None, cart_max_boxes=1):
+        super().__init__(shipping_cache=shipping_cache, rate_limiter=rate_limiter, session_pool=session_pool, circuit_breaker=circuit_breaker)
+        # Até quantas caixas de cada oferta são cotadas para o otimizador de carrinho (app/cart.py)
+        self.cart_max_boxes = cart_max_boxes
+        self.storefront = storefront
+        self.pharmacy = storefront.pharmacy
+        self.host = urlparse(storefront.base_url).hostname
+        self.base_url = storefront.base_url
+
+    @timed("search_medication")
+    def search_medication(self, term, cep=None, accept=None, limit=None):
+        """
+        Gera as ofertas página a página. `accept(título)` descarta produtos antes do
+        cálculo de frete e `limit` encerra a paginação quando já há ofertas suficientes.
+        """
+        # Intelligent Search para capturar promoções (teasers)
+        api_url = (f"{self.base_url}/api/io/_v/api/intelligent-search/product_search/"
+                   f"trade-policy/{self.storefront.trade_policy}?query={term}")
+        print(f"    Buscando {self.pharmacy} via Intelligent Search: {api_url}")
+
+        found = 0
         try:
-            headers = self.headers.copy()
-            headers["Content-Type"] = "application/json"
-            # Define o cookie de CEP para tentar "forçar" o contexto regional na VTEX
-            headers["Cookie"] = f"vtex_postalCode={cep.replace('-', '')};"
-            
-            resp = self.fetcher.post(url, data=json.dumps(payload), headers=headers)
-            if resp.status in [200, 206]:
-                data = json.loads(resp.body)
-                logistics = data.get("shippingData", {}).get("logisticsInfo", [])
-                if logistics:
-                    slas = logistics[0].get("slas", [])
-                    if slas:
-                        # FILTRO: Ignorar "Retire na Loja" (deliveryChannel != 'delivery')
-                        delivery_slas = [s for s in slas if s.get("deliveryChannel") == "delivery"]
-                        if delivery_slas:
-                            prices = [float(s.get("price", 99999)) / 100.0 for s in delivery_slas]
-                            return min(prices) if prices else 0.0
-                        else:
-                            # Se só houver retirada, o frete de entrega é "infinito" ou não disponível
-                            return 0.0 
+            pages = self.search_pages(
+                lambda page: f"{api_url}&count={self.SEARCH_PAGE_SIZE}&page={page}",
+                lambda data: self._parse_search_page(data, cep, accept),
+                limit
+            )
+            for offer in pages:
+                found += 1
+                yield offer
         except Exception as e:
-            print(f"    Erro ao calcular frete Pague Menos: {e}")
-        return 0.0
-
-class DrogariaSaoPauloScraper(BaseScraper):
-    def search_medication(self, term, cep=None):
-        # Drogaria SP as vezes funciona via API direto
-        api_url = f"https://www.drogariasaopaulo.com.br/api/io/_v/api/intelligent-search/product_search/trade-policy/1?query={term}&count=48&page=1"
-        print(f"    Buscando Drogaria São Paulo via API: {api_url}")
-        
+            print(f"    Erro ao consultar API {self.pharmacy}: {e}")
+
+        # Fallback se a API falhar ou não trouxer nada
+        if not found and self.storefront.fallback == "ld_json":
+            yield from self._search_ld_json(term, accept)
+        elif not found and self.storefront.fallback == "html":
+            yield from self._search_html(term, accept)
+
+    def _parse_search_page(self, data, cep, accept):
+        """
+        Ofertas em estoque de uma página do Intelligent Search, já com frete. Cada oferta
+        traz em "cart" as opções de compra de 1 até `cart_max_boxes` caixas (promoções
+        progressivas e frete de cada quantidade), cotadas numa única simulação em lote.
+        """
+        products = data.get("products", [])
         results = []
-        try:
-            # Usamos o fetcher para herdar os benefícios de evasão de bot
-            resp = self.fetcher.get(api_url)
-            if resp.status in [200, 206]:
-                data = json.loads(resp.body)
-                for prod in data.get("products", []):
-                    title = prod.get("productName")
-                    items = prod.get("items", [])
-                    if items:
-                        item = items[0]
-                        price = 0
-                        sellers = item.get("sellers", [])
-                        if sellers:
-                            offer = sellers[0].get("commertialOffer", {})
-                            available_qty = offer.get("AvailableQuantity", 0)
-                            
-                            # FILTRO DE ESTOQUE
-                            if available_qty > 0:
-                                price = float(offer.get("Price", 0))
-                                if price > 0:
-                                    # Detecta promoções (teasers)
-                                    teasers = offer.get("teasers", [])
-                                    final_price, promo_info = self.calculate_best_unit_price(price, teasers, available_qty)
-                                    
-                                    display_title = title
-                                    if promo_info:
-                                        display_title += f" ({promo_info})"
-
-                                    link = "https://www.drogariasaopaulo.com.br" + prod.get("link", "")
-                                    qty = self.parse_quantity(title)
-                                    
-                                    # Calcula frete
-                                    shipping_cost = 0.0
-                                    sku = item.get("itemId")
-                                    if cep and sku:
-                                        shipping_cost = self.fetch_shipping_cost(sku, cep)
-                                        
-                                    results.append({
-                                        "pharmacy": "Drogaria São Paulo",
-                                        "title": display_title,
-                                        "price": final_price,
-                                        "quantity": qty,
-                                        "unit_price": final_price / qty if qty > 0 else final_price,
-                                        "url": link,
-                                        "shipping": shipping_cost
-                                    })
-        except Exception as e:
-            print(f"    Erro ao consultar API Drogaria SP: {e}")
-            
-        # Fallback HTML se API falhar
-        if not results:
-            url = f"https://www.drogariasaopaulo.com.br/search?_q={term}"
-            html = self.fetch_page(url)
-            if html:
-                parser = HTMLParser(html)
-                cards = parser.css(".product-item") or parser.css("[class*='product-card']")
-                for card in cards:
-                    title_elem = card.css_first("[class*='name']")
-                    price_elem = card.css_first("[class*='price']")
-                    link_elem = card.css_first("a")
-                    if title_elem and price_elem:
-                        title = title_elem.text(strip=True)
-                        price = self.parse_price(price_elem.text())
-                        link = link_elem.attributes.get("href", "")
-                        if link and not link.startswith("http"):
-                            link = "https://www.drogariasaopaulo.com.br" + link
-                        
-                        # Fallback CSS: Verificar se o card indica esgotado
-                        card_html = card.html().lower()
-                        if "esgotado" in card_html or "avise-me" in card_html:
-                            continue
+        carts = []
+        for prod in products:
+            title = prod.get("productName")
+            # Filtro de termos antes de qualquer cálculo de frete
+            if accept and not accept(title or ""):
+                continue
+            items = prod.get("items", [])
+            if items:
+                item = items[0]
+                sellers = item.get("sellers", [])
+                if sellers:
+                    offer = sellers[0].get("commertialOffer", {})
+                    available_qty = offer.get("AvailableQuantity", 0)
+
+                    # FILTRO DE ESTOQUE
+                    if available_qty > 0:
+                        base_price = float(offer.get("Price", 0))
+                        if base_price > 0:
+                            link = self.base_url + prod.get("link", "")
+                            qty = self.parse_quantity(title)
+
+                            results.append({
+                                "pharmacy": self.pharmacy,
+                                "title": title,
+                                "price": base_price,
+                                "quantity": qty,
+                                "unit_price": base_price / qty if qty > 0 else base_price,
+                                "url": link,
+                                "shipping": 0.0
+                            })
+                            # Promoções progressivas (ex: Leve 3 Pague 2) só valem comprando a faixa; o
+                            # otimizador de carrinho decide a quantidade e o título ganha a promoção atingida
+                            boxes = cart_quantities(self.cart_max_boxes, available_qty)
+                            tiers = promotion_tiers(offer.get("teasers", []))
+                            carts.append((item.get("itemId"), base_price, tiers, boxes))
+
+        # Frete de todos os SKUs da página, em todas as quantidades candidatas, em uma única simulação
+        shipping_costs = {}
+        if cep:
+            keys = [cart_key(sku, n) for sku, _, _, boxes in carts if sku for n in boxes]
+            shipping_costs = self.fetch_shipping_costs(keys, cep)
+        for res, (sku, base_price, tiers, boxes) in zip(results, carts):
+            res["shipping"] = shipping_costs.get(cart_key(sku, 1), 0.0) if sku else 0.0
+            res["cart"] = cart_options(base_price, tiers, quoted_shipping(shipping_costs, sku, boxes, res["shipping"]))
+        return results, len(products)
+
+    def _search_ld_json(self, term, accept=None):
+        url = f"{self.base_url}/search?_q={term}"
+        body = self.fetch_body(url)
+        if not body: return
+        for script in script_contents(body, b"application/ld+json"):
+            offers_in_script = []
+            try:
+                data = loads(script)
+                if data.get("@type") == "ItemList" and "itemListElement" in data:
+                    for item in data["itemListElement"]:
+                        prod = item.get("item", {})
+                        if prod.get("@type") == "Product":
+                            offers = prod.get("offers", {})
+                            availability = offers.get("availability")
+                            # FILTRO DE ESTOQUE LD+JSON
+                            if availability == "https://schema.org/InStock":
+                                title = prod.get("name")
+                                if accept and not accept(title or ""):
+                                    continue
+                                price = offers.get("lowPrice") or offers.get("price", 0)
+                                link = prod.get("url")
+                                qty = self.parse_quantity(title)
+                                offers_in_script.append({
+                                    "pharmacy": self.pharmacy,
+                                    "title": title,
+                                    "price": float(price),
+                                    "quantity": qty,
+                                    "unit_price": float(price) / qty if qty > 0 else float(price),
+                                    "url": link,
+                                    "shipping": 0.0
+                                })
+            except: continue
+            yield from offers_in_script
+
+    def _search_html(self, term, accept=None):
+        url = f"{self.base_url}/search?_q={term}"
+        html = self.fetch_page(url)
+        if not html: return []
+        from selectolax.parser import HTMLParser
+        parser = HTMLParser(html)
+        results = []
+        cards = parser.css(".product-item") or parser.css("[class*='product-card']")
+        for card in cards:
+            title_elem = card.css_first("[class*='name']")
+            price_elem = card.css_first("[class*='price']")
+            link_elem = card.css_first("a")
+            if title_elem and price_elem:
+                title = title_elem.text(strip=True)
+                if accept and not accept(title):
+                    continue
+                price = self.parse_price(price_elem.text())
+                link = link_elem.attributes.get("href", "")
+                if link and not link.startswith("http"):
+                    link = self.base_url + link
 
-                        qty = self.parse_quantity(title)
-                        results.append({
-                            "pharmacy": "Drogaria São Paulo",
-                            "title": title,
-                            "price": price,
-                            "quantity": qty,
-                            "unit_price": price / qty if qty > 0 else price,
-                            "url": link,
-                            "shipping": 0.0 # Fallback HTML is simplified
-                        })
+                # Fallback CSS: Verificar se o card indica esgotado
+                card_html = card.html().lower()
+                if "esgotado" in card_html or "avise-me" in card_html:
+                    continue
+
+                qty = self.parse_quantity(title)
+                results.append({
+                    "pharmacy": self.pharmacy,
+                    "title": title,
+                    "price": price,
+                    "quantity": qty,
+                    "unit_price": price / qty if qty > 0 else price,
+                    "url": link,
+                    "shipping": 0.0 # Fallback HTML is simplified
+                })
         return results
 
+    @timed("fetch_shipping_cost")
+    def fetch_shipping_costs(self, skus, cep):
+        """Simulação de frete VTEX em lote. Retorna {sku: frete}."""
+        url = self.base_url + self.storefront.simulation_path
+        # A política comercial 1 é a padrão da VTEX; as demais vão no parâmetro sc
+        if self.storefront.trade_policy != 1:
+            url += f"?sc={self.storefront.trade_policy}"
+        # Cotando várias quantidades, cada (SKU, caixas) vai num carrinho próprio: só assim o
+        # frete de cada quantidade (e o frete grátis a partir de um valor) é o de uma compra real
+        return self.cached_shipping_costs(
+            skus, cep, lambda missing: self.simulate_vtex_shipping(
+                url, missing, cep, self.pharmacy, separate_carts=self.cart_max_boxes > 1
+            )
+        )
+
     def fetch_shipping_cost(self, sku, cep):
-        """Simulação de frete VTEX para Drogaria SP."""
+        """Simulação de frete VTEX para um único SKU."""
         if not cep or not sku: return 0.0
-        url = "https://www.drogariasaopaulo.com.br/api/checkout/pub/orderforms/simulation"
-        payload = {
-            "items": [{"id": str(sku), "quantity": 1, "seller": "1"}],
-            "country": "BRA",
-            "postalCode": cep.replace("-", ""),
-            "shippingData": {
-                "address": {
-                    "postalCode": cep.replace("-", ""),
-                    "country": "BRA"
-                }
-            }
-        }
-        try:
-            headers = self.headers.copy()
-            headers["Content-Type"] = "application/json"
-            headers["Cookie"] = f"vtex_postalCode={cep.replace('-', '')};"
-            
-            resp = self.fetcher.post(url, data=json.dumps(payload), headers=headers)
-            if resp.status in [200, 206]:
-                data = json.loads(resp.body)
-                logistics = data.get("shippingData", {}).get("logisticsInfo", [])
-                if logistics:
-                    slas = logistics[0].get("slas", [])
-                    if slas:
-                        delivery_slas = [s for s in slas if s.get("deliveryChannel") == "delivery"]
-                        if delivery_slas:
-                            prices = [float(s.get("price", 99999)) / 100.0 for s in delivery_slas]
-                            return min(prices) if prices else 0.0
-                        else:
-                            return 0.0
-        except Exception as e:
-            print(f"    Erro ao calcular frete Drogaria SP: {e}")
-        return 0.0
+        return self.fetch_shipping_costs([sku], cep).get(str(sku), 0.0)
+
+class PagueMenosScraper(VtexScraper):
+    host = "www.paguemenos.com.br"
+    pharmacy = "Pague Menos"
+
+    def __init__(self, **shared):
+        super().__init__(PAGUE_MENOS, **shared)
+
+class DrogariaSaoPauloScraper(VtexScraper):
+    host = "www.drogariasaopaulo.com.br"
+    pharmacy = "Drogaria São Paulo"
+
+    def __init__(self, **shared):
+        super().__init__(DROGARIA_SAO_PAULO, **shared)
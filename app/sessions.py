@@ -0,0 +1,107 @@
+import importlib.util
+import threading
+from urllib.parse import urlparse
+
+# Scrapling (curl-cffi/playwright) e httpx são importados só quando a primeira
+# sessão é criada, para não pesar no tempo de inicialização do main.py
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class SessionPool:
+    """
+    Sessões HTTP reutilizáveis por host, compartilhadas pelas buscas, PDPs e fretes.
+
+    - Scrapling (curl-cffi): sessões persistentes por host, emprestadas a cada requisição
+      e devolvidas ao terminar, já que a sessão do curl não deve ser usada por duas
+      threads ao mesmo tempo. O número de sessões de um host acompanha o pico de
+      requisições simultâneas a ele, e não o número de threads que já existiram.
+    - httpx (fallback): um Client com pool de conexões keep-alive por host, seguro
+      entre threads, com HTTP/2 quando o pacote `h2` está instalado.
+    """
+
+    def __init__(self, headers=None, timeout=15.0, max_connections=10):
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._idle = {}
+        self._stealth_sessions = []
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def stealth(self, url):
+        """Sessão Scrapling (curl-cffi) do host da URL; cada get/post usa uma sessão livre do pool."""
+        return _PooledStealth(self, urlparse(url).hostname)
+
+    def _checkout(self, host):
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if idle:
+                return idle.pop()
+        try:
+            from scrapling.fetchers import FetcherSession
+        except ImportError:  # versões antigas do Scrapling não têm sessões persistentes
+            FetcherSession = None
+        if FetcherSession is None:
+            from scrapling import Fetcher
+            return Fetcher()
+        manager = FetcherSession(timeout=self.timeout)
+        session = manager.__enter__()
+        with self._lock:
+            self._stealth_sessions.append(manager)
+        return session
+
+    def _checkin(self, host, session):
+        with self._lock:
+            self._idle.setdefault(host, []).append(session)
+
+    def _request(self, host, method, url, **kwargs):
+        session = self._checkout(host)
+        try:
+            return getattr(session, method)(url, **kwargs)
+        finally:
+            self._checkin(host, session)
+
+    def client(self, url):
+        """Client httpx do host da URL, compartilhado entre as threads."""
+        host = urlparse(url).hostname
+        with self._lock:
+            if host not in self._clients:
+                import httpx
+                self._clients[host] = httpx.Client(
+                    headers=self.headers,
+                    follow_redirects=True,
+                    timeout=self.timeout,
+                    http2=HTTP2_AVAILABLE,
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections
+                    )
+                )
+            return self._clients[host]
+
+    def close(self):
+        with self._lock:
+            for manager in self._stealth_sessions:
+                try:
+                    manager.__exit__(None, None, None)
+                except Exception:
+                    pass
+            self._stealth_sessions = []
+            self._idle = {}
+            for client in self._clients.values():
+                client.close()
+            self._clients = {}
+
+
+class _PooledStealth:
+    """Sessão Scrapling de um host: cada requisição pega emprestada uma sessão livre do pool."""
+
+    def __init__(self, pool, host):
+        self.pool = pool
+        self.host = host
+
+    def get(self, url, **kwargs):
+        return self.pool._request(self.host, "get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.pool._request(self.host, "post", url, **kwargs)
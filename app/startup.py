@@ -0,0 +1,73 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependências pesadas que só devem ser carregadas quando forem usadas de fato
+LAZY_MODULES = ("scrapling", "curl_cffi", "playwright", "httpx", "selectolax", "dotenv", "smtplib")
+
+
+def import_times(module="main"):
+    """
+    Importa `module` em um interpretador novo com `python -X importtime`.
+    Retorna [(módulo, tempo próprio µs, tempo acumulado µs)] apenas dos imports feitos
+    por `module` (sem a inicialização do próprio interpretador, como `site`).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # O relatório lista os filhos antes do pai; nível 0 = import de primeiro nível
+        top_level = not name[1:].startswith(" ")
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+        if top_level and name.strip() != module:
+            entries = []
+        elif top_level:
+            break
+    return entries
+
+
+def check_startup(budget_ms, runs=3, top=10, module="main"):
+    """Mede o import de `module` (mediana de `runs` execuções) e compara com o orçamento."""
+    totals = []
+    for _ in range(runs):
+        entries = import_times(module)
+        totals.append(next(cumulative for name, _, cumulative in entries if name == module) / 1000)
+    median_ms = statistics.median(totals)
+
+    print(f"Import de {module}: {median_ms:.1f} ms (mediana de {runs}; orçamento {budget_ms:.0f} ms)")
+    print("Módulos mais lentos (acumulado):")
+    for name, _, cumulative in sorted(entries, key=lambda e: e[2], reverse=True)[:top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    loaded = sorted({name.split(".")[0] for name, _, _ in entries} & set(LAZY_MODULES))
+    ok = True
+    if loaded:
+        print(f"ERRO: dependências que deveriam ser carregadas sob demanda foram importadas: {', '.join(loaded)}")
+        ok = False
+    if median_ms > budget_ms:
+        print(f"ERRO: inicialização acima do orçamento ({median_ms:.1f} ms > {budget_ms:.0f} ms)")
+        ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verifica o tempo de inicialização do main.py")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", 250)),
+                        help="Tempo máximo para importar o main.py (padrão: 250 ms)")
+    parser.add_argument("--runs", type=int, default=3, help="Medições (usa a mediana)")
+    parser.add_argument("--top", type=int, default=10, help="Quantos módulos lentos exibir")
+    args = parser.parse_args()
+    sys.exit(0 if check_startup(args.budget_ms, args.runs, args.top) else 1)
+
+
+if __name__ == "__main__":
+    main()
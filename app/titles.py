@@ -0,0 +1,116 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# Padrões compilados uma única vez (antes eram recompilados/buscados a cada título)
+QUANTITY_PATTERN = re.compile(r'(\d+)\s*(comprimidos|caps|drag|unid|comp|drágeas|cápsulas)', re.IGNORECASE)
+COMMON_COUNT_PATTERN = re.compile(r'\b(20|21|28|30|42|56|60|84|90)\b')
+DOSAGE_PATTERN = re.compile(r'(\d+(?:[.,]\d+)?)\s*mg\b', re.IGNORECASE)
+PACK_PATTERN = re.compile(r'\bkit\s*(?:com\s*)?(\d+)|\b(\d+)\s*(?:caixas|cxs?)\b', re.IGNORECASE)
+PRICE_CLEAN_PATTERN = re.compile(r'[^\d,]')
+FORMS = (
+    ("comprimido", re.compile(r'\bcomp(?:rimidos?|\.|\b)', re.IGNORECASE)),
+    ("cápsula", re.compile(r'\bc[aá]ps(?:ulas?|\.|\b)', re.IGNORECASE)),
+    ("drágea", re.compile(r'\bdr[aá]g(?:eas?|\.|\b)', re.IGNORECASE)),
+    ("gotas", re.compile(r'\bgotas\b', re.IGNORECASE)),
+    ("solução", re.compile(r'\bsolu[çc][ãa]o\b', re.IGNORECASE)),
+    ("xarope", re.compile(r'\bxarope\b', re.IGNORECASE)),
+    ("suspensão", re.compile(r'\bsuspens[ãa]o\b', re.IGNORECASE)),
+    ("injetável", re.compile(r'\binjet[aá]vel\b', re.IGNORECASE)),
+    ("pomada", re.compile(r'\bpomada\b', re.IGNORECASE)),
+    ("creme", re.compile(r'\bcreme\b', re.IGNORECASE)),
+)
+
+# Quantidade de títulos distintos mantidos em memória (LRU)
+TITLE_CACHE_SIZE = 4096
+
+TitleInfo = namedtuple("TitleInfo", ["quantity", "dosage_mg", "pack_size", "form"])
+
+
+@lru_cache(maxsize=TITLE_CACHE_SIZE)
+def parse_title(title):
+    """
+    Extrai de um título de produto a quantidade de unidades, a dosagem (mg),
+    o número de caixas do kit e a forma farmacêutica. Resultados ficam em cache por título.
+    """
+    if not title:
+        return TitleInfo(1, None, 1, None)
+    return TitleInfo(_quantity(title), _dosage(title), _pack_size(title), _form(title))
+
+
+def _quantity(title):
+    # Procura padrões como "30 comprimidos", "28 drágeas", "60 caps"
+    match = QUANTITY_PATTERN.search(title)
+    if match:
+        return int(match.group(1))
+    # Fallback: procurar qualquer número isolado que pareça uma contagem comum
+    match = COMMON_COUNT_PATTERN.search(title)
+    return int(match.group(1)) if match else 1
+
+
+def _dosage(title):
+    match = DOSAGE_PATTERN.search(title)
+    return float(match.group(1).replace(",", ".")) if match else None
+
+
+def _pack_size(title):
+    match = PACK_PATTERN.search(title)
+    if not match:
+        return 1
+    return int(match.group(1) or match.group(2)) or 1
+
+
+def _form(title):
+    for form, pattern in FORMS:
+        if pattern.search(title):
+            return form
+    return None
+
+
+def parse_quantity(title):
+    return parse_title(title).quantity
+
+
+def parse_price(price_str):
+    if not price_str: return 0.0
+    # Remove R$, dots, and replace comma with dot
+    clean = PRICE_CLEAN_PATTERN.sub('', price_str).replace(',', '.')
+    try:
+        return float(clean) if clean else 0.0
+    except ValueError:
+        return 0.0
+
+
+@lru_cache(maxsize=TITLE_CACHE_SIZE)
+def upper_title(title):
+    return title.upper()
+
+
+class TitleFilter:
+    """Filtro de um produto (required_terms), com os termos normalizados uma única vez."""
+
+    def __init__(self, required_terms):
+        self.terms = tuple(term.upper() for term in required_terms)
+
+    def matches(self, title):
+        if not self.terms:
+            return True
+        title_upper = upper_title(title)
+        return all(term in title_upper for term in self.terms)
+
+
+@lru_cache(maxsize=256)
+def compile_filter(required_terms):
+    """Filtro compilado para uma tupla de required_terms; reaproveitado entre ofertas e produtos."""
+    return TitleFilter(required_terms)
+
+
+def filter_for(product):
+    return compile_filter(tuple(product.get("required_terms", [])))
+
+
+def compile_filters(products):
+    """Descarta os filtros antigos e compila os de todos os produtos (a cada carga do config)."""
+    compile_filter.cache_clear()
+    for product in products:
+        filter_for(product)
@@ -1,119 +1,481 @@
+import argparse
+import os
 import time
 from datetime import datetime
+from app.breaker import CircuitBreaker
+from app.cache import ShippingCache
+from app.cart import best_option
 from app.config import Config
 from app.database import Database
-from app.notifier import Notifier
-from app.scraper import PagueMenosScraper, DrogasilScraper, DrogariaSaoPauloScraper
+from app.metrics import metrics
+from app.notifier import Notifier, Outbox
+from app.pipeline import HistoryWriter, OfferPipeline
+from app.ratelimit import RateLimiter
+from app.reports import PriceReports, export_report, print_report
+from app.replay import RecordingSessionPool, ReplaySessionPool
+from app.runner import ConcurrentRunner, SearchPlan, StageTimer
+from app.scheduler import ProductScheduler, parse_interval
+from app.sessions import SessionPool
+from app.titles import compile_filters, filter_for
+from app.scraper import PagueMenosScraper, DrogasilScraper, DrogariaSaoPauloScraper, VtexScraper, vtex_storefront
 
-def main():
-    config_data = Config.load_products()
-    products = config_data.get("products", [])
-    
-    db = Database()
+def pharmacy_label(scraper):
+    return scraper.pharmacy
+
+def is_snoozed(product):
+    snooze_until_str = product.get("snooze_until")
+    if snooze_until_str:
+        try:
+            snooze_date = datetime.strptime(snooze_until_str, "%Y-%m-%d")
+            if datetime.now() < snooze_date:
+                return True
+        except ValueError:
+            print(f"  Aviso: Formato de data inválido para snooze em {product['name']}. Use AAAA-MM-DD.")
+    return False
+
+def announce_product(product, snoozed, cep):
+    print(f"\nBuscando: {product['name']} ({product['search_term']})")
+    print(f"  -> Alvo por Caixa: R$ {product['threshold_price']:.2f}")
+    if snoozed:
+        print(f"  -> ALERTAS PAUSADOS até: {product.get('snooze_until')}")
+    if cep:
+        print(f"  -> CEP: {cep}")
+
+def fetch_offers(scraper, search_term, cep, accept=None):
+    """
+    Gera as ofertas de uma busca em uma farmácia à medida que o scraper as encontra.
+    `accept(título)` descarta, já dentro da busca, produtos que nenhum dos produtos do
+    config aceitaria. Em caso de erro, a busca termina (as ofertas já geradas valem).
+    """
+    pharmacy_name = pharmacy_label(scraper)
+    if scraper.circuit_breaker.is_open(scraper.host):
+        # Site fora do ar ou bloqueando: pula a farmácia sem nenhuma requisição
+        scraper.circuit_breaker.skip(scraper.host)
+        print(f"  Pulando {pharmacy_name} ({search_term}): circuito aberto")
+        return
+    print(f"  Pesquisando em {pharmacy_name} ({search_term})...")
+    try:
+        # Passa o CEP para os scrapers; a busca é paginada e para ao juntar ofertas suficientes
+        yield from scraper.search_medication(search_term, cep=cep, accept=accept, limit=Config.SEARCH_MAX_OFFERS)
+    except Exception as e:
+        print(f"    Erro ao processar {pharmacy_name}: {e}")
+
+def select_offers(product, results):
+    """
+    Retorna cópias dos resultados que passam nos filtros do produto, com o preço unitário efetivo.
+    Quando a farmácia cotou várias quantidades, preço e frete passam a ser por caixa na melhor
+    quantidade (`boxes`), até o "max_boxes" do produto.
+    """
+    title_filter = filter_for(product)
+    filtered = []
+    for res in results:
+        # Aplicar filtros (ex: "2mg")
+        if title_filter.matches(res["title"]):
+            # O mesmo resultado pode servir a vários produtos, então cada um recebe sua cópia
+            offer = dict(res)
+            # Otimizador de carrinho: melhor quantidade de caixas (promoção e frete divididos por caixa)
+            option = best_option(offer.pop("cart", None) or [], product.get("max_boxes", Config.CART_MAX_BOXES))
+            offer["boxes"] = 1
+            if option:
+                offer["boxes"] = option.boxes
+                offer["price"] = option.items_total / option.boxes
+                offer["shipping"] = option.shipping / option.boxes
+                offer["unit_price"] = offer["price"] / offer["quantity"] if offer["quantity"] > 0 else offer["price"]
+                if option.promotion:
+                    offer["title"] += f" ({option.promotion})"
+            # Cálculo do Preço Unitário Efetivo: (Preço + Frete) / Quantidade
+            offer["total_effective_unit"] = (offer["price"] + offer["shipping"]) / offer["quantity"]
+            filtered.append(offer)
+    return filtered
+
+def evaluate_product(db, stream, snoozed, dry_run=False, outbox=None):
+    """
+    Decide se a melhor oferta de um produto (ProductStream já completo) deve ser notificada
+    e grava a oferta vencedora; as demais já foram para o banco durante a busca.
+    Com `outbox`, o alerta é enfileirado e enviado na hora pela sessão SMTP da execução.
+    Retorna o preço total (com frete) da melhor oferta, ou None se não houve resultados.
+    """
+    product = stream.product
+    name = product["name"]
+    threshold = product["threshold_price"]
+
+    # Melhor oferta (menor unit_price_efetivo para comparar caixas de tamanhos diferentes),
+    # mantida durante a busca
+    best_offer = stream.best
+    if best_offer is None:
+        print("  Nenhum resultado encontrado com os filtros aplicados.")
+        stream.finish()
+        return None
+
+    # Custo por caixa (com frete); com boxes > 1, a compra recomendada é de várias caixas
+    total_price_with_shipping = best_offer['price'] + best_offer['shipping']
+    alert_title = best_offer["title"]
+    if best_offer["boxes"] > 1:
+        alert_title += f" - comprar {best_offer['boxes']} caixas"
+        print(f"  -> Melhor compra: {best_offer['boxes']} caixas na {best_offer['pharmacy']} "
+              f"(R$ {total_price_with_shipping:.2f}/caixa, total R$ {total_price_with_shipping * best_offer['boxes']:.2f})")
+
+    # Verificar se devemos notificar
+    last_notified = db.get_last_notified_offer(name)
+    should_notify = False
+
+    if total_price_with_shipping < threshold and not snoozed:
+        if not last_notified:
+            should_notify = True
+        else:
+            # Compara farmácia e preço (com pequena margem para evitar ruído de centavos se necessário)
+            # Aqui usamos 0.01 como diferença mínima
+            price_diff = abs(total_price_with_shipping - last_notified["price"])
+            pharmacy_changed = (best_offer["pharmacy"] != last_notified["pharmacy"])
+
+            if price_diff > 0.01 or pharmacy_changed:
+                should_notify = True
+
+    if should_notify and dry_run:
+        print(f"  [dry-run] Alerta não enviado: {alert_title} na {best_offer['pharmacy']} por R$ {total_price_with_shipping:.2f}")
+        should_notify = False
+    elif should_notify and outbox is not None:
+        outbox.add(
+            product_name=alert_title,
+            pharmacy=best_offer["pharmacy"],
+            price=total_price_with_shipping,
+            url=best_offer["url"]
+        )
+    elif should_notify:
+        Notifier.send_alert(
+            product_name=alert_title,
+            pharmacy=best_offer["pharmacy"],
+            price=total_price_with_shipping, # Valor total da caixa
+            url=best_offer["url"]
+        )
+
+    # Marcar como notificado apenas o ganhador, e só se o alerta foi enviado agora
+    stream.finish(notified=should_notify)
+    return total_price_with_shipping
+
+def build_scrapers(storefronts=(), **shared):
+    """
+    Cria os scrapers das farmácias compartilhando cache de frete, limitador e pool de sessões.
+    `storefronts` são as entradas de `vtex_storefronts` do config.json: cada uma vira mais
+    uma farmácia VTEX (ou substitui a configuração embutida de mesmo nome).
+    """
     scrapers = [
-        PagueMenosScraper(),
-        DrogasilScraper(),
-        DrogariaSaoPauloScraper()
+        PagueMenosScraper(**shared, cart_max_boxes=Config.CART_MAX_BOXES),
+        DrogasilScraper(
+            **shared,
+            pdp_workers=Config.PDP_WORKERS,
+            pdp_cache_ttl=Config.PDP_CACHE_TTL_SECONDS,
+            cart_max_boxes=Config.CART_MAX_BOXES
+        ),
+        DrogariaSaoPauloScraper(**shared, cart_max_boxes=Config.CART_MAX_BOXES)
     ]
-    
-    cep = config_data.get("cep")
-    
-    for product in products:
-        name = product["name"]
-        search_term = product["search_term"]
-        required_terms = product.get("required_terms", [])
-        threshold = product["threshold_price"]
-        snooze_until_str = product.get("snooze_until")
-        
-        is_snoozed = False
-        if snooze_until_str:
-            try:
-                snooze_date = datetime.strptime(snooze_until_str, "%Y-%m-%d")
-                if datetime.now() < snooze_date:
-                    is_snoozed = True
-            except ValueError:
-                print(f"  Aviso: Formato de data inválido para snooze em {name}. Use AAAA-MM-DD.")
-        
-        print(f"\nBuscando: {name} ({search_term})")
-        print(f"  -> Alvo por Caixa: R$ {threshold:.2f}")
-        if is_snoozed:
-            print(f"  -> ALERTAS PAUSADOS até: {snooze_until_str}")
-        if cep:
-            print(f"  -> CEP: {cep}")
-        
-        all_results = []
-        
-        for scraper in scrapers:
-            pharmacy_name = scraper.__class__.__name__.replace("Scraper", "")
-            print(f"  Pesquisando em {pharmacy_name}...")
-            
-            try:
-                # Passa o CEP para os scrapers
-                results = scraper.search_medication(search_term, cep=cep)
-                
-                for res in results:
-                    # Aplicar filtros (ex: "2mg")
-                    title_upper = res["title"].upper()
-                    if all(term.upper() in title_upper for term in required_terms):
-                        # Cálculo do Preço Unitário Efetivo: (Preço + Frete) / Quantidade
-                        res["total_effective_unit"] = (res["price"] + res["shipping"]) / res["quantity"]
-                        all_results.append(res)
-            except Exception as e:
-                print(f"    Erro ao processar {pharmacy_name}: {e}")
-            
-            time.sleep(2)
-        
-        if not all_results:
-            print("  Nenhum resultado encontrado com os filtros aplicados.")
+    for entry in storefronts:
+        try:
+            storefront = vtex_storefront(entry)
+        except ValueError as e:
+            print(f"  Aviso: loja VTEX ignorada ({e})")
             continue
-            
-        # Encontrar a melhor oferta (menor unit_price_efetivo para comparar caixas de tamanhos diferentes)
-        best_offer = min(all_results, key=lambda x: x["total_effective_unit"])
-        
-        total_price_with_shipping = best_offer['price'] + best_offer['shipping']
-        
-        # Verificar se devemos notificar
-        last_notified = db.get_last_notified_offer(name)
-        should_notify = False
-        
-        if total_price_with_shipping < threshold and not is_snoozed:
-            if not last_notified:
-                should_notify = True
-            else:
-                # Compara farmácia e preço (com pequena margem para evitar ruído de centavos se necessário)
-                # Aqui usamos 0.01 como diferença mínima
-                price_diff = abs(total_price_with_shipping - last_notified["price"])
-                pharmacy_changed = (best_offer["pharmacy"] != last_notified["pharmacy"])
-                
-                if price_diff > 0.01 or pharmacy_changed:
-                    should_notify = True
-
-        if should_notify:
-            Notifier.send_alert(
-                product_name=best_offer["title"],
-                pharmacy=best_offer["pharmacy"],
-                price=total_price_with_shipping, # Valor total da caixa
-                url=best_offer["url"]
-            )
-
-        # Salvar TODOS os resultados filtrados no banco, marcando o vencedor
-        for res in all_results:
-            is_winner = (res == best_offer)
-            # Marcar como notificado apenas se for o ganhador E o alerta foi enviado agora
-            was_notified = (is_winner and should_notify)
-            
-            db.save_price(
-                pharmacy=res["pharmacy"],
-                product_name=res["title"],
-                unit_price=res["unit_price"], # Preço unitário puro (sem frete)
-                total_price=res["price"],     # Preço total da caixa
-                shipping_cost=res["shipping"],
-                total_effective_price=res["total_effective_unit"], # Preço unitário com frete proporcional
-                is_kit=(res["quantity"] > 1),
-                kit_size=res["quantity"],
-                is_best_offer=is_winner,
-                notified=was_notified
-            )
+        scraper = VtexScraper(storefront, **shared, cart_max_boxes=Config.CART_MAX_BOXES)
+        scrapers = [s for s in scrapers if s.pharmacy != storefront.pharmacy] + [scraper]
+    return scrapers
+
+def build_session_pool(record_dir=None, replay_dir=None):
+    if replay_dir:
+        return ReplaySessionPool(replay_dir)
+    if record_dir:
+        return RecordingSessionPool(record_dir)
+    return SessionPool()
+
+def build_shipping_cache(db, config_data):
+    return ShippingCache(
+        db,
+        ttl_hours=Config.SHIPPING_CACHE_TTL_HOURS,
+        max_entries=Config.SHIPPING_CACHE_MAX_ENTRIES,
+        # TTL opcional por farmácia, ex: {"Drogasil": 12}
+        ttl_by_pharmacy=config_data.get("shipping_cache_ttl_hours", {})
+    )
+
+def build_outbox(db):
+    # Alertas vão para a fila do banco e são enviados juntos no final (uma sessão SMTP)
+    return Outbox(
+        db,
+        digest=Config.EMAIL_DIGEST,
+        max_attempts=Config.EMAIL_MAX_ATTEMPTS,
+        retry_delay=Config.EMAIL_RETRY_DELAY
+    )
+
+def build_circuit_breaker(db, replay_dir=None):
+    # Estado por host guardado no banco; no replay não há rede, então fica desligado
+    if replay_dir:
+        return CircuitBreaker.disabled()
+    return CircuitBreaker(
+        db,
+        failure_threshold=Config.CIRCUIT_FAILURE_THRESHOLD,
+        cooldown=Config.CIRCUIT_COOLDOWN_SECONDS,
+        max_cooldown=Config.CIRCUIT_MAX_COOLDOWN_SECONDS
+    )
+
+def build_rate_limiter(replay_dir=None):
+    # Um único limitador para todos os scrapers: cada host tem seu próprio token bucket.
+    # No replay não há rede, então o limite é desligado.
+    if replay_dir:
+        return RateLimiter.unlimited()
+    return RateLimiter(
+        rate=Config.RATE_LIMIT_PER_SECOND,
+        burst=Config.RATE_LIMIT_BURST,
+        min_rate=Config.RATE_LIMIT_MIN,
+        max_rate=Config.RATE_LIMIT_MAX
+    )
+
+def serial_streams(plan, pipeline, timer):
+    """Executa as buscas do plano uma a uma, gerando cada produto assim que suas buscas terminam."""
+    for key, (scraper, term, search_cep) in plan.searches.items():
+        with timer.track(f"busca {pharmacy_label(scraper)}"):
+            pipeline.feed(key, fetch_offers(scraper, term, search_cep, plan.accept_for(key)))
+        yield from pipeline.complete(key)
+
+def run_plan(plan, scrapers, db, outbox, timer, dry_run=False, runner=None):
+    """
+    Executa as buscas do plano (em paralelo se houver `runner`) e avalia cada produto.
+    As ofertas passam pelo OfferPipeline enquanto chegam: filtro, melhor oferta corrente
+    por produto e gravação em lotes. Retorna {nome do produto: preço total da melhor oferta}.
+    """
+    best_prices = {}
+    pipeline = OfferPipeline(plan, select_offers, HistoryWriter(db))
+    if runner:
+        streams = runner.run(plan, fetch_offers, pipeline)
+    else:
+        streams = serial_streams(plan, pipeline, timer)
+    for stream in streams:
+        product = stream.product
+        snoozed = is_snoozed(product)
+        announce_product(product, snoozed, plan.cep_for(product))
+        with timer.track("decisão e gravação"):
+            best_prices[product["name"]] = evaluate_product(db, stream, snoozed, dry_run, outbox)
+    return best_prices
+
+def build_runner(scrapers, timer, max_workers=None, host_concurrency=None):
+    return ConcurrentRunner(
+        scrapers,
+        max_workers=max_workers or Config.MAX_WORKERS,
+        host_concurrency=host_concurrency or Config.HOST_CONCURRENCY,
+        timer=timer
+    )
+
+def main(concurrent=False, max_workers=None, host_concurrency=None, record_dir=None, replay_dir=None, dry_run=False, db_name="prices.db"):
+    config_data = Config.load_products()
+    products = config_data.get("products", [])
+    # Filtros de título (required_terms) compilados uma vez por carga do config
+    compile_filters(products)
+
+    metrics.reset()
+    db = Database(db_name, history_mode=Config.HISTORY_MODE)
+    shipping_cache = build_shipping_cache(db, config_data)
+    shipping_cache.evict()
+    outbox = build_outbox(db)
+    rate_limiter = build_rate_limiter(replay_dir)
+    circuit_breaker = build_circuit_breaker(db, replay_dir)
+    # Pool de sessões compartilhado: conexões keep-alive reaproveitadas por host
+    session_pool = build_session_pool(record_dir, replay_dir)
+    # No replay o cache de frete fica desligado, para que as fixtures sejam sempre exercitadas
+    scrapers = build_scrapers(
+        config_data.get("vtex_storefronts", []),
+        shipping_cache=None if replay_dir else shipping_cache,
+        rate_limiter=rate_limiter,
+        session_pool=session_pool,
+        circuit_breaker=circuit_breaker
+    )
+
+    cep = config_data.get("cep")
+    timer = StageTimer()
+
+    # Cada (farmácia, termo, CEP) é buscado uma única vez, mesmo que vários produtos o usem
+    plan = SearchPlan(products, scrapers, cep)
+    print(f"Plano de execução: {plan.summary()}")
+
+    try:
+        runner = build_runner(scrapers, timer, max_workers, host_concurrency) if concurrent else None
+        run_plan(plan, scrapers, db, outbox, timer, dry_run, runner)
+    finally:
+        session_pool.close()
+        # Reenvia os alertas que falharam (inclusive pendentes de execuções anteriores) e fecha a sessão SMTP
+        if not dry_run:
+            outbox.flush()
+        # Resumo da execução em JSON, textfile do Prometheus e tabela run_metrics
+        metrics.export(Config.METRICS_DIR, db)
+        db.close()
+
+    timer.report()
+    shipping_cache.report()
+    rate_limiter.report()
+    circuit_breaker.report()
+
+def daemon(concurrent=False, max_workers=None, host_concurrency=None, dry_run=False, db_name="prices.db"):
+    """
+    Processo contínuo: banco, scrapers e sessões HTTP ficam abertos entre as verificações,
+    cada produto é verificado no seu próprio intervalo e o config.json é recarregado
+    quando muda, sem reiniciar.
+    """
+    config_data = Config.load_products()
+    config_mtime = Config.products_mtime()
+    compile_filters(config_data.get("products", []))
+
+    db = Database(db_name, history_mode=Config.HISTORY_MODE)
+    shipping_cache = build_shipping_cache(db, config_data)
+    outbox = build_outbox(db)
+    rate_limiter = build_rate_limiter()
+    session_pool = build_session_pool()
+    circuit_breaker = build_circuit_breaker(db)
+    shared = {
+        "shipping_cache": shipping_cache,
+        "rate_limiter": rate_limiter,
+        "session_pool": session_pool,
+        "circuit_breaker": circuit_breaker,
+    }
+    scrapers = build_scrapers(config_data.get("vtex_storefronts", []), **shared)
+
+    scheduler = ProductScheduler(
+        default_interval=parse_interval(Config.DAEMON_CHECK_EVERY, 6 * 3600),
+        near_threshold=Config.DAEMON_NEAR_THRESHOLD
+    )
+    scheduler.load(config_data.get("products", []))
+    print(f"Modo daemon: {len(scheduler.products)} produtos agendados (Ctrl+C para encerrar)")
+
+    try:
+        while True:
+            mtime = Config.products_mtime()
+            if mtime != config_mtime:
+                config_mtime = mtime
+                config_data = Config.load_products()
+                compile_filters(config_data.get("products", []))
+                shipping_cache.ttl_by_pharmacy = config_data.get("shipping_cache_ttl_hours", {})
+                scheduler.load(config_data.get("products", []))
+                # Lojas VTEX novas ou alteradas passam a valer na próxima verificação
+                scrapers = build_scrapers(config_data.get("vtex_storefronts", []), **shared)
+                print(f"\nconfig.json recarregado: {len(scheduler.products)} produtos agendados")
+
+            due = scheduler.due()
+            if due:
+                metrics.reset()
+                timer = StageTimer()
+                shipping_cache.evict()
+                plan = SearchPlan(due, scrapers, config_data.get("cep"))
+                print(f"\n[{datetime.now():%Y-%m-%d %H:%M:%S}] Plano de execução: {plan.summary()}")
+                try:
+                    runner = build_runner(scrapers, timer, max_workers, host_concurrency) if concurrent else None
+                    best_prices = run_plan(plan, scrapers, db, outbox, timer, dry_run, runner)
+                finally:
+                    if not dry_run:
+                        outbox.flush()
+                    metrics.export(Config.METRICS_DIR, db)
+                scheduler.record(due, best_prices)
+                timer.report()
+                circuit_breaker.report()
+
+            time.sleep(scheduler.seconds_until_next(Config.DAEMON_POLL_SECONDS))
+    except KeyboardInterrupt:
+        print("\nEncerrando o daemon...")
+    finally:
+        session_pool.close()
+        db.close()
+
+def clear_shipping_cache(pharmacy=None, db_name="prices.db"):
+    db = Database(db_name)
+    removed = db.invalidate_shipping_cache(pharmacy)
+    db.close()
+    print(f"Cache de frete limpo ({pharmacy or 'todas as farmácias'}): {removed} cotações removidas.")
+
+def compact_database(db_name="prices.db", vacuum=True):
+    db = Database(db_name)
+    size_before = os.path.getsize(db.db_path)
+    before, after = db.compact_history(vacuum=vacuum)
+    size_after = os.path.getsize(db.db_path)
+    db.close()
+    print(f"Histórico compactado: {before} -> {after} linhas; arquivo {size_before / 1024:.0f} KB -> {size_after / 1024:.0f} KB")
+
+def export_history(db_name="prices.db", directory=None, full=False):
+    directory = directory or Config.COLUMNAR_DIR
+    db = Database(db_name)
+    start = time.perf_counter()
+    added, total = db.export_columnar(directory, full=full)
+    db.close()
+    print(f"Exportação colunar em {directory}: {added} linhas novas, {total} no total ({time.perf_counter() - start:.1f}s)")
+
+def show_report(db_name="prices.db", days=30, percentile=90, product=None, output=None):
+    db = Database(db_name)
+    report = PriceReports(db).build(days=days, percentile=percentile / 100, product=product)
+    db.close()
+    if output:
+        export_report(report, output)
+        print(f"Relatório salvo em {output}")
+    else:
+        print_report(report)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Monitor de preços de medicamentos")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="Pesquisa todas as farmácias e vários produtos ao mesmo tempo")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Número máximo de buscas simultâneas (modo concorrente)")
+    parser.add_argument("--host-concurrency", type=int, default=None,
+                        help="Número máximo de buscas simultâneas por farmácia (modo concorrente)")
+    parser.add_argument("--db", default="prices.db",
+                        help="Arquivo do banco SQLite (padrão: prices.db)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Não envia e-mails; os alertas são apenas exibidos")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Executa continuamente, verificando cada produto no seu intervalo (check_every)")
+    parser.add_argument("--record", metavar="DIR", default=None,
+                        help="Grava todas as respostas HTTP como fixtures no diretório informado")
+    parser.add_argument("--replay", metavar="DIR", default=None,
+                        help="Usa as fixtures gravadas no diretório informado em vez da rede")
+
+    subparsers = parser.add_subparsers(dest="command")
+    cache_parser = subparsers.add_parser("cache", help="Gerencia o cache de frete")
+    cache_parser.add_argument("action", choices=["clear"])
+    cache_parser.add_argument("--pharmacy", default=None,
+                              help="Limpa apenas a farmácia informada (ex: \"Drogasil\")")
+    db_parser = subparsers.add_parser("db", help="Manutenção do banco")
+    db_parser.add_argument("action", choices=["compact", "export"],
+                           help="compact: reescreve o histórico guardando só as mudanças de preço e executa VACUUM; "
+                                "export: exporta o histórico em formato colunar (apenas as linhas novas)")
+    db_parser.add_argument("--no-vacuum", action="store_true", help="Não executa VACUUM após compactar")
+    db_parser.add_argument("--output", default=None,
+                           help="Diretório da exportação colunar (padrão: COLUMNAR_DIR, history_columnar/)")
+    db_parser.add_argument("--full", action="store_true", help="Refaz a exportação colunar do zero")
+    report_parser = subparsers.add_parser("report", help="Relatório de preços a partir do histórico")
+    report_parser.add_argument("--days", type=int, default=30, help="Período analisado em dias (padrão: 30)")
+    report_parser.add_argument("--percentile", type=float, default=90, help="Percentil de preço exibido (padrão: 90)")
+    report_parser.add_argument("--product", default=None, help="Apenas um produto do config.json")
+    report_parser.add_argument("--output", default=None,
+                               help="Exporta para um arquivo .json (completo) ou .csv (estatísticas)")
+    return parser
 
 if __name__ == "__main__":
-    main()
+    args = build_parser().parse_args()
+    if args.command == "cache":
+        clear_shipping_cache(args.pharmacy, args.db)
+    elif args.command == "report":
+        show_report(args.db, args.days, args.percentile, args.product, args.output)
+    elif args.command == "db" and args.action == "export":
+        export_history(args.db, args.output, full=args.full)
+    elif args.command == "db":
+        compact_database(args.db, vacuum=not args.no_vacuum)
+    elif args.daemon:
+        daemon(
+            concurrent=args.concurrent,
+            max_workers=args.workers,
+            host_concurrency=args.host_concurrency,
+            dry_run=args.dry_run,
+            db_name=args.db
+        )
+    else:
+        main(
+            concurrent=args.concurrent,
+            max_workers=args.workers,
+            host_concurrency=args.host_concurrency,
+            record_dir=args.record,
+            replay_dir=args.replay,
+            dry_run=args.dry_run,
+            db_name=args.db
+        )